@@ -14,14 +14,16 @@ Uso:
 """
 import os
 import sys
-import json
 import time
+import shutil
+import selectors
 import signal
 import socket
 import threading
 import subprocess
 import requests
 import argparse
+import functools
 from urllib.parse import urlparse
 from django.conf import settings
 from django.core.management import call_command
@@ -32,52 +34,241 @@ ngrok_ready_event = threading.Event()
 # Lista para mantener referencia a los procesos
 processes = []
 
-def close_all_processes():
-    """Cierra todos los procesos de forma ordenada, incluyendo ngrok"""
-    print("\n🛑️ Cerrando todos los procesos...")
+# Sesión HTTP reutilizable para la API local de ngrok (mantiene la conexión entre reintentos)
+NGROK_API_URL = 'http://localhost:4040/api/tunnels'
+_ngrok_api = requests.Session()
+
+def _iter_pids_matching(pattern):
+    """
+    Itera los PIDs cuya línea de comandos contiene `pattern` (equivalente a `pgrep -f`).
+    
+    Lee /proc directamente para evitar lanzar un proceso por consulta; en sistemas
+    sin /proc (p. ej. macOS) recurre a pgrep.
+    """
+    if not os.path.isdir('/proc/self'):
+        result = subprocess.run(['pgrep', '-f', pattern], capture_output=True, text=True)
+        for pid in result.stdout.split():
+            yield int(pid)
+        return
+    
+    needle = pattern.encode()
+    own_pid = os.getpid()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == own_pid:
+            continue
+        try:
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ')
+        except OSError:
+            # El proceso terminó mientras recorríamos /proc o no tenemos permisos
+            continue
+        if needle in cmdline:
+            yield int(entry)
+
+def _listening_sockets():
+    """
+    Lee /proc/net/tcp{,6} una sola vez y devuelve {puerto: {inodos}} de los
+    sockets en LISTEN.
+    """
+    sockets = {}
+    for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # fields[1] = dirección local "IP:PUERTO" en hex, fields[3] = estado (0A = LISTEN)
+            if fields[3] == '0A':
+                port = int(fields[1].rsplit(':', 1)[1], 16)
+                sockets.setdefault(port, set()).add(fields[9])
+    return sockets
+
+def _pids_listening_on_port(port):
+    """
+    Devuelve los PIDs que escuchan en un puerto TCP (equivalente a `lsof -i :PORT -t`).
+    
+    Busca los sockets en LISTEN en /proc/net/tcp{,6} y resuelve su inodo al PID
+    leyendo los descriptores de /proc/<pid>/fd; sin /proc recurre a lsof.
+    """
+    if not os.path.isdir('/proc/self'):
+        result = subprocess.run(['lsof', '-i', f':{port}', '-t'], capture_output=True, text=True)
+        return [int(pid) for pid in result.stdout.split()]
+    
+    inodes = _listening_sockets().get(port)
+    if not inodes:
+        return []
+    
+    targets = {f'socket:[{inode}]' for inode in inodes}
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        fd_dir = f'/proc/{entry}/fd'
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) in targets:
+                    pids.append(int(entry))
+                    break
+            except OSError:
+                continue
+    return pids
+
+def _kill_pid(pid, timeout=5):
+    """
+    Envía SIGTERM a un proceso y, si no termina dentro de `timeout` segundos, SIGKILL.
+    
+    Returns:
+        True si el proceso ya no existe al finalizar
+    """
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return True
+    
+    if _wait_pid_exit(pid, timeout):
+        return True
+    
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        return True
+    return _wait_pid_exit(pid, 1)
+
+def _wait_pid_exit(pid, timeout):
+    """Espera hasta `timeout` segundos a que `pid` deje de existir; devuelve si terminó"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+
+def _signal_process_group(process, sig):
+    """
+    Envía `sig` al grupo de procesos de un hijo lanzado con start_new_session=True,
+    de modo que también reciba la señal cualquier proceso que haya lanzado él.
+    """
+    try:
+        os.killpg(os.getpgid(process.pid), sig)
+    except ProcessLookupError:
+        pass
+    except OSError:
+        process.send_signal(sig)
+
+def _terminate_processes(procs, timeout=5):
+    """
+    Termina varios procesos hijos (y sus grupos de procesos) en paralelo.
     
-    # Primero intentamos cerrar los procesos que tenemos registrados
-    for process in processes:
+    Envía SIGTERM a todos primero y luego espera a que terminen con un único plazo
+    global (vía pidfd en Linux), de modo que el cierre tarda lo que el más lento y no
+    la suma de todos. Los que sigan vivos al vencer el plazo reciben SIGKILL.
+    
+    Args:
+        procs: Procesos (subprocess.Popen) a terminar
+        timeout: Plazo total de espera en segundos
+    """
+    alive = [p for p in procs if p.poll() is None]
+    for process in alive:
         try:
             print(f"🔄 Terminando proceso: {process.args[0] if hasattr(process, 'args') else 'desconocido'}")
-            process.terminate()
-            process.wait(timeout=5)
+            _signal_process_group(process, signal.SIGTERM)
         except Exception as e:
             print(f"⚠️ Error al cerrar proceso: {e}")
     
+    deadline = time.monotonic() + timeout
+    if hasattr(os, 'pidfd_open'):
+        selector = selectors.DefaultSelector()
+        for process in alive:
+            try:
+                selector.register(os.pidfd_open(process.pid), selectors.EVENT_READ, process)
+            except OSError:
+                continue
+        
+        try:
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(timeout=remaining):
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    key.data.wait()  # Ya terminó: solo recoge el código de salida
+        finally:
+            for key in list(selector.get_map().values()):
+                selector.unregister(key.fd)
+                os.close(key.fd)
+            selector.close()
+    else:
+        for process in alive:
+            try:
+                process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                pass
+    
+    for process in alive:
+        if process.poll() is None:
+            print(f"⚠️ El proceso {process.pid} no terminó a tiempo, forzando cierre...")
+            _signal_process_group(process, signal.SIGKILL)
+            process.wait()
+
+def close_all_processes(find_orphans=False):
+    """
+    Cierra todos los procesos de forma ordenada, incluyendo ngrok.
+    
+    Args:
+        find_orphans: Buscar también procesos de ngrok/runserver que no lanzó este
+            proceso (p. ej. con --stop desde otra terminal)
+    """
+    print("\n🛑️ Cerrando todos los procesos...")
+    
+    # Los hijos corren en su propio grupo de procesos: un killpg por hijo basta
+    try:
+        _terminate_processes(processes)
+    except Exception as e:
+        print(f"⚠️ Error al cerrar procesos: {e}")
+    
+    if find_orphans:
+        _kill_orphan_processes()
+    
+    _remove_ngrok_files()
+    
+    print("✅ Todos los procesos han sido cerrados.")
+
+def _kill_orphan_processes():
+    """Termina procesos de ngrok y Django runserver lanzados por otra ejecución del script"""
     # Asegurarnos de que ngrok se cierre correctamente
     try:
         print("🔄 Buscando procesos de ngrok...")
-        ngrok_pids = subprocess.run(
-            ["pgrep", "-f", "ngrok http"],
-            capture_output=True, 
-            text=True
-        ).stdout.strip().split('\n')
-        
-        for pid in ngrok_pids:
-            if pid:
-                print(f"🔄 Terminando ngrok (PID: {pid})...")
-                subprocess.run(["kill", pid])
+        for pid in _iter_pids_matching("ngrok http"):
+            print(f"🔄 Terminando ngrok (PID: {pid})...")
+            if not _kill_pid(pid):
+                print(f"⚠️ ngrok (PID: {pid}) sigue en ejecución")
     except Exception as e:
         print(f"⚠️ Error al buscar/terminar ngrok: {e}")
     
     # Asegurarnos de que Django runserver se cierre correctamente
     try:
         print("🔄 Buscando procesos de Django runserver...")
-        django_pids = subprocess.run(
-            ["pgrep", "-f", "runserver"],
-            capture_output=True, 
-            text=True
-        ).stdout.strip().split('\n')
-        
-        for pid in django_pids:
-            if pid:
-                print(f"🔄 Terminando Django runserver (PID: {pid})...")
-                subprocess.run(["kill", pid])
+        for pid in _iter_pids_matching("runserver"):
+            print(f"🔄 Terminando Django runserver (PID: {pid})...")
+            if not _kill_pid(pid):
+                print(f"⚠️ Django runserver (PID: {pid}) sigue en ejecución")
     except Exception as e:
         print(f"⚠️ Error al buscar/terminar Django runserver: {e}")
-    
-    # Eliminar archivos temporales de ngrok
+
+def _remove_ngrok_files():
+    """Elimina los archivos temporales que escribe run_ngrok"""
     try:
         base_dir = os.path.dirname(os.path.abspath(__file__))
         ngrok_host_file = os.path.join(base_dir, 'ngrok_host.txt')
@@ -92,62 +283,71 @@ def close_all_processes():
             print("🔄 Archivo temporal ngrok_url.txt eliminado")
     except Exception as e:
         print(f"⚠️ Error al eliminar archivos temporales de ngrok: {e}")
-    
-    print("✅ Todos los procesos han sido cerrados.")
 
 def signal_handler(sig, frame):
     """Manejador de señales para cierre ordenado"""
     close_all_processes()
     sys.exit(0)
 
+@functools.cache
 def setup_django():
-    """Configura Django para ser usado fuera de un entorno web"""
+    """
+    Configura Django para ser usado fuera de un entorno web.
+    
+    Se memoriza: django.setup() solo tiene que correr una vez por proceso y
+    se llama tanto al arrancar como en cada actualización del túnel/webhook.
+    """
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'breaders_twilio_bot.settings')
     import django
     django.setup()
     from django.conf import settings
     return settings
 
-def check_port_in_use(port):
+def _bound_ports():
+    """
+    Devuelve el conjunto de puertos TCP en LISTEN, o None si no hay /proc.
+    
+    Una sola lectura de /proc/net/tcp{,6} sirve para comprobar todos los
+    puertos candidatos sin abrir un socket por cada uno.
+    """
+    if not os.path.isdir('/proc/self'):
+        return None
+    return set(_listening_sockets())
+
+def check_port_in_use(port, bound_ports=None):
     """Verifica si un puerto está en uso"""
+    if bound_ports is None:
+        bound_ports = _bound_ports()
+    if bound_ports is not None:
+        return port in bound_ports
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) == 0
 
 def find_free_port(start_port=8000, max_attempts=10):
     """Encuentra un puerto libre a partir de start_port"""
-    port = start_port
-    attempts = 0
-    
-    while check_port_in_use(port) and attempts < max_attempts:
-        port += 1
-        attempts += 1
+    bound_ports = _bound_ports()
     
-    if attempts >= max_attempts:
-        raise Exception(f"No se pudo encontrar un puerto libre después de {max_attempts} intentos")
+    for port in range(start_port, start_port + max_attempts):
+        if not check_port_in_use(port, bound_ports):
+            return port
     
-    return port
+    raise Exception(f"No se pudo encontrar un puerto libre después de {max_attempts} intentos")
 
 def kill_process_on_port(port):
     """Intenta matar el proceso que está usando un puerto específico"""
     try:
         # Obtener el PID del proceso que usa el puerto
-        result = subprocess.run(
-            ["lsof", "-i", f":{port}", "-t"],
-            capture_output=True,
-            text=True
-        )
+        pids = _pids_listening_on_port(port)
         
-        if result.returncode != 0 or not result.stdout.strip():
+        if not pids:
             return False
         
-        pid = result.stdout.strip()
-        print(f"🔄 Intentando terminar proceso en puerto {port} (PID: {pid})...")
-        
-        # Intentar matar el proceso
-        kill_result = subprocess.run(["kill", pid])
+        for pid in pids:
+            print(f"🔄 Intentando terminar proceso en puerto {port} (PID: {pid})...")
+            # Intentar matar el proceso (espera a que termine)
+            _kill_pid(pid)
         
         # Verificar si el puerto ahora está libre
-        time.sleep(1)  # Dar tiempo para que el proceso termine
         return not check_port_in_use(port)
     except Exception as e:
         print(f"⚠️ Error al intentar liberar el puerto {port}: {e}")
@@ -193,7 +393,8 @@ def run_django():
         print(f"🚀 Iniciando servidor Django en el puerto {port}...")
         django_process = subprocess.Popen(
             [sys.executable, 'manage.py', 'runserver', f'0.0.0.0:{port}', '--verbosity', '2'],
-            cwd=os.path.dirname(os.path.abspath(__file__))
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            start_new_session=True
         )
         processes.append(django_process)
         
@@ -212,6 +413,33 @@ def run_django():
         print("\nPor favor, verifica la configuración de tu proyecto Django.")
         sys.exit(1)
 
+# Segundos durante los que se reutiliza el listado de números de Twilio
+TWILIO_NUMBERS_TTL = 60
+
+@functools.lru_cache(maxsize=None)
+def _get_twilio_client(account_sid, auth_token):
+    """
+    Devuelve un cliente de Twilio compartido por credenciales.
+    
+    TwilioHttpClient mantiene una requests.Session con pool de conexiones, así que
+    las llamadas sucesivas reutilizan la conexión TLS en lugar de negociar una nueva.
+    La importación se hace aquí (y no al cargar el módulo) porque check_dependencies()
+    puede instalar twilio después de arrancar el script.
+    """
+    from twilio.rest import Client
+    from twilio.http.http_client import TwilioHttpClient
+    
+    return Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True))
+
+@functools.lru_cache(maxsize=1)
+def _list_incoming_phone_numbers(account_sid, auth_token, time_bucket):
+    """
+    Lista los números de la cuenta; `time_bucket` cambia cada TWILIO_NUMBERS_TTL
+    segundos, lo que invalida la entrada cacheada.
+    """
+    client = _get_twilio_client(account_sid, auth_token)
+    return client.incoming_phone_numbers.list()
+
 def update_twilio_webhook(ngrok_url):
     """
     Actualiza el webhook de Twilio con la URL de ngrok
@@ -238,11 +466,10 @@ def update_twilio_webhook(ngrok_url):
         
         try:
             # Intentar actualizar el webhook automáticamente usando la API de Twilio
-            from twilio.rest import Client
-            client = Client(account_sid, auth_token)
-            
             # Buscar números de WhatsApp asociados a la cuenta
-            incoming_phone_numbers = client.incoming_phone_numbers.list()
+            incoming_phone_numbers = _list_incoming_phone_numbers(
+                account_sid, auth_token, int(time.monotonic() // TWILIO_NUMBERS_TTL)
+            )
             whatsapp_numbers = []
             
             for number in incoming_phone_numbers:
@@ -284,26 +511,73 @@ def update_twilio_webhook(ngrok_url):
         print(f"   2. En 'When a message comes in', configura esta URL: {ngrok_url}/webhook/whatsapp/")
         print(f"   3. Asegúrate de seleccionar HTTP POST como método")
 
+def _wait_for_ngrok_tunnel(ngrok_process, timeout=15):
+    """
+    Espera a que ngrok anuncie el túnel en su log (stdout) en lugar de dormir un tiempo fijo.
+    
+    Usa un selector sobre el pipe de stdout y, en Linux, un pidfd para enterarse al
+    instante si ngrok termina antes de tiempo.
+    
+    Args:
+        ngrok_process: Proceso de ngrok iniciado con stdout=PIPE
+        timeout: Tiempo máximo de espera en segundos
+        
+    Returns:
+        True si ngrok informó el túnel, False si terminó o se agotó el tiempo
+    """
+    stdout_fd = ngrok_process.stdout.fileno()
+    selector = selectors.DefaultSelector()
+    selector.register(stdout_fd, selectors.EVENT_READ, 'log')
+    
+    pidfd = None
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(ngrok_process.pid)
+            selector.register(pidfd, selectors.EVENT_READ, 'exit')
+        except OSError:
+            pidfd = None
+    
+    buffer = b''
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            for key, _ in selector.select(timeout=remaining):
+                if key.data == 'exit':
+                    return False
+                
+                chunk = os.read(stdout_fd, 65536)
+                if not chunk:  # EOF: ngrok cerró su salida
+                    return False
+                
+                buffer += chunk
+                if b'started tunnel' in buffer or b'url=https://' in buffer:
+                    return True
+                # Conservar solo la última línea (posiblemente incompleta)
+                buffer = buffer.rsplit(b'\n', 1)[-1]
+    finally:
+        selector.close()
+        if pidfd is not None:
+            os.close(pidfd)
+
 def run_ngrok():
     """Ejecuta ngrok y actualiza la configuración de Django con la nueva URL"""
     # Verificar si ngrok ya está en ejecución
     try:
-        check_ngrok = subprocess.run(
-            ['pgrep', '-f', 'ngrok http'],
-            capture_output=True,
-            text=True
-        )
-        if check_ngrok.stdout.strip():
+        running_ngrok = list(_iter_pids_matching('ngrok http'))
+        if running_ngrok:
             print("⚠️ ngrok ya está en ejecución. Terminando proceso anterior...")
-            subprocess.run(['pkill', '-f', 'ngrok http'])
-            time.sleep(2)  # Dar más tiempo para que termine
+            for pid in running_ngrok:
+                if not _kill_pid(pid):
+                    print(f"⚠️ No se pudo terminar ngrok (PID: {pid})")
     except Exception as e:
         print(f"ℹ️ No se pudo verificar si ngrok está en ejecución: {e}")
     
     # Verificar si ngrok está instalado
-    try:
-        subprocess.run(['which', 'ngrok'], check=True, capture_output=True)
-    except subprocess.CalledProcessError:
+    if shutil.which('ngrok') is None:
         print("❌ ngrok no está instalado. Por favor, instálalo desde https://ngrok.com/download")
         ngrok_ready_event.set()  # Señalizar para continuar con el flujo
         return
@@ -315,7 +589,8 @@ def run_ngrok():
             ['ngrok', 'http', '8000', '--log=stdout'],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            universal_newlines=True
+            universal_newlines=True,
+            start_new_session=True
         )
         processes.append(ngrok_process)
     except Exception as e:
@@ -324,9 +599,15 @@ def run_ngrok():
         ngrok_ready_event.set()
         return
     
-    # Dar a ngrok tiempo suficiente para iniciar
+    # Esperar a que ngrok anuncie el túnel en su log
     print("⏳ Esperando a que ngrok inicie completamente...")
-    time.sleep(5)  # Aumentar el tiempo de espera inicial
+    if not _wait_for_ngrok_tunnel(ngrok_process):
+        if ngrok_process.poll() is not None:
+            print(f"❌ ngrok terminó inesperadamente (código {ngrok_process.returncode})")
+            print("Continuando sin ngrok. El servidor solo será accesible localmente.")
+            ngrok_ready_event.set()
+            return
+        print("⚠️ ngrok no informó el túnel a tiempo, consultando su API de todos modos...")
     
     # Intentar obtener información del túnel con reintentos
     max_retries = 5  # Aumentar el número de reintentos
@@ -337,25 +618,12 @@ def run_ngrok():
     while not tunnel_found and retry_count < max_retries:
         try:
             print(f"🔄 Obteniendo información del túnel ngrok (intento {retry_count + 1}/{max_retries})...")
-            # Intentar acceder directamente a la API de túneles con seguimiento de redirecciones
+            # Intentar acceder directamente a la API de túneles (requests sigue redirecciones)
             print(f"🔄 Intentando acceder a la API de ngrok...")
             
-            # Usar -L para seguir redirecciones
-            ngrok_api = subprocess.run(
-                ['curl', '-s', '-L', 'http://localhost:4040/api/tunnels'],
-                capture_output=True,
-                text=True
-            )
-            
-            # Verificar que la respuesta no esté vacía
-            if not ngrok_api.stdout.strip():
-                print("⚠️ Respuesta vacía de la API de ngrok, reintentando...")
-                retry_count += 1
-                time.sleep(wait_time)
-                wait_time += 1
-                continue
-                
-            tunnels = json.loads(ngrok_api.stdout)
+            response = _ngrok_api.get(NGROK_API_URL, timeout=2)
+            response.raise_for_status()
+            tunnels = response.json()
             
             if not tunnels.get('tunnels'):
                 print("⚠️ No se encontraron túneles en la respuesta de ngrok, reintentando...")
@@ -408,9 +676,13 @@ def run_ngrok():
                 retry_count += 1
                 time.sleep(wait_time)
                 wait_time += 1
-        except json.JSONDecodeError as e:
+        except requests.RequestException as e:
+            print(f"⚠️ Error al consultar la API de ngrok (intento {retry_count + 1}): {e}")
+            retry_count += 1
+            time.sleep(wait_time)
+            wait_time += 1
+        except ValueError as e:
             print(f"⚠️ Error al decodificar JSON de ngrok (intento {retry_count + 1}): {e}")
-            print(f"Respuesta recibida: '{ngrok_api.stdout[:100]}...'" if len(ngrok_api.stdout) > 100 else f"Respuesta recibida: '{ngrok_api.stdout}'")
             retry_count += 1
             time.sleep(wait_time)
             wait_time += 1
@@ -468,7 +740,7 @@ if __name__ == "__main__":
     
     # Si se solicita detener los procesos, hacerlo y salir
     if args.stop:
-        close_all_processes()
+        close_all_processes(find_orphans=True)
         sys.exit(0)
     
     # Si se solicita verificar dependencias, hacerlo y salir
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class WhatsappBotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'whatsapp_bot'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (registra los receptores de señales)
+        from .utils.log_queue import start_queue_logging
+        start_queue_logging()
@@ -1,13 +1,135 @@
 import logging
 import re
-from typing import Optional
+import threading
+from typing import Dict, Optional, Tuple
 from django.conf import settings
 from .base_handler import BaseConversationHandler
-from ..services.handlers.chatbot_handler import ChatbotHandler
+from ..services.handlers.chatbot_handler import get_chatbot_handler
 from ..services.handlers.twilio_ai_handler import TwilioAIHandler
 
+try:
+    import hyperscan
+except ImportError:  # hyperscan es opcional; sin él se usa el patrón unificado de `re`
+    hyperscan = None
+
 logger = logging.getLogger(__name__)
 
+# Patrones de intención mejorados con más variaciones y expresiones comunes
+INTENT_PATTERNS = {
+    'saludo': r'\b(hola|buenas|saludos|buen[ao]s\s*(d[ií]as|tardes|noches)|qu[eé]\s*tal|c[oó]mo\s*est[aá]n)\b',
+    'productos': r'\b(productos?|cat[aá]logos?|ver\s*productos|milanesas?|ofertas?|qu[eé]\s*(tienen|ofrecen|venden)|tipos\s*de\s*milanesas|disponibles?|veganas?|vegetarianas?)\b',
+    'pedido': r'\b(pedidos?|[oó]rdenes?|estados?|seguimientos?|hice\s*un\s*pedido|cu[aá]ndo\s*llegar[aá]|pedido\s*[#]?\d+)\b',
+    'ayuda': r'\b(ayuda|soporte|problemas?|necesito\s*ayuda|consultas?|dudas?|preguntas?)\b',
+    'horarios': r'\b(horarios?|abiertos?|cerrados?|atenci[oó]n|hasta\s*qu[eé]\s*hora|qu[eé]\s*d[ií]as?|domingos?)\b',
+    'pago': r'\b(pagos?|formas?\s*de\s*pago|efectivo|tarjetas?|transferencias?|mercadopago|descuentos?|american\s*express|cr[eé]dito|d[eé]bito)\b',
+    'menu': r'\b(men[uú]s?|opciones|comandos|^[1-9]$)\b'  # Incluye números del 1-9 como opciones de menú
+}
+
+# Patrón unificado compilado una sola vez: cada intención es un grupo con nombre,
+# de modo que un único recorrido del mensaje clasifica todas las coincidencias
+_INTENT_RE = re.compile(
+    '|'.join(f'(?P<{intent}>{pattern})' for intent, pattern in INTENT_PATTERNS.items()),
+    re.IGNORECASE
+)
+
+# Plegado de acentos para Hyperscan: su \b solo reconoce palabras ASCII, así que
+# se normalizan tanto los patrones como el mensaje (la longitud no cambia)
+_ACCENT_FOLD = str.maketrans('áéíóúüñÁÉÍÓÚÜÑ', 'aeiouunAEIOUUN')
+_INTENT_NAMES = tuple(INTENT_PATTERNS)
+
+# Hyperscan no admite anclas de inicio embebidas, por lo que la opción numérica
+# de menú (^[1-9]$) se quita de su patrón y se resuelve aparte con `re`
+_MENU_DIGIT_ALTERNATIVE = '|^[1-9]$'
+_MENU_DIGIT_RE = re.compile(r'^[1-9]$')
+
+
+def _compile_hyperscan_db():
+    """
+    Compila todas las intenciones en una base de datos de Hyperscan (DFA multi-patrón).
+    
+    Returns:
+        La base de datos compilada, o None si hyperscan no está disponible
+    """
+    if hyperscan is None:
+        return None
+    
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[
+                INTENT_PATTERNS[intent].replace(_MENU_DIGIT_ALTERNATIVE, '').translate(_ACCENT_FOLD).encode()
+                for intent in _INTENT_NAMES
+            ],
+            ids=list(range(len(_INTENT_NAMES))),
+            elements=len(_INTENT_NAMES),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(_INTENT_NAMES)
+        )
+        return db
+    except Exception as e:
+        logger.warning(f"No se pudo compilar la base de Hyperscan, usando re: {str(e)}")
+        return None
+
+
+_HS_DB = _compile_hyperscan_db()
+
+# Cada hilo del servidor necesita su propio scratch de Hyperscan
+_hs_local = threading.local()
+
+
+def _get_hs_scratch():
+    """Devuelve el scratch de Hyperscan del hilo actual, creándolo una sola vez."""
+    scratch = getattr(_hs_local, 'scratch', None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_HS_DB)
+    return scratch
+
+
+def _scan_intents(message: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Recorre el mensaje una sola vez y acumula las coincidencias por intención.
+    
+    Args:
+        message: El mensaje del usuario
+        
+    Returns:
+        Tupla con (cantidad de coincidencias, longitud total coincidente) por intención
+    """
+    match_counts = {}
+    match_lengths = {}
+    
+    if _HS_DB is None:
+        # Cada coincidencia se atribuye a su intención mediante el nombre del grupo
+        for match in _INTENT_RE.finditer(message):
+            intent = match.lastgroup
+            match_counts[intent] = match_counts.get(intent, 0) + 1
+            match_lengths[intent] = match_lengths.get(intent, 0) + match.end() - match.start()
+        return match_counts, match_lengths
+    
+    if _MENU_DIGIT_RE.match(message):
+        match_counts['menu'] = 1
+        match_lengths['menu'] = 1
+    
+    spans = {}
+    
+    def on_match(pattern_id, start, end, flags, context):
+        spans.setdefault(pattern_id, []).append((start, end))
+    
+    _HS_DB.scan(message.translate(_ACCENT_FOLD).encode(), match_event_handler=on_match, scratch=_get_hs_scratch())
+    
+    # Hyperscan informa todas las coincidencias (incluso solapadas); se conservan
+    # las no solapadas más a la izquierda y, ante empate, la más corta, que es la
+    # que elegiría `re` porque las alternativas simples van primero en los patrones
+    for pattern_id, intent_spans in spans.items():
+        intent = _INTENT_NAMES[pattern_id]
+        last_end = -1
+        for start, end in sorted(intent_spans):
+            if start >= last_end:
+                match_counts[intent] = match_counts.get(intent, 0) + 1
+                match_lengths[intent] = match_lengths.get(intent, 0) + end - start
+                last_end = end
+    
+    return match_counts, match_lengths
+
 class ConversationHandler(BaseConversationHandler):
     """
     Maneja la conversación principal, detectando intenciones y delegando a los manejadores específicos.
@@ -15,7 +137,7 @@ class ConversationHandler(BaseConversationHandler):
     
     def __init__(self):
         """Inicializa el manejador de conversación con sus sub-manejadores."""
-        self.chatbot_handler = ChatbotHandler()
+        self.chatbot_handler = get_chatbot_handler()
         self.ai_handler = TwilioAIHandler()
         
         # Umbral de confianza para determinar si usar el asistente AI
@@ -36,36 +158,35 @@ class ConversationHandler(BaseConversationHandler):
         # En un sistema real, esto podría usar NLP más avanzado
         
         logger.debug(f"Detectando intención para mensaje: '{message}'")
-        
-        # Patrones de intención mejorados con más variaciones y expresiones comunes
-        intent_patterns = {
-            'saludo': r'\b(hola|buenas|saludos|buen[ao]s\s*(d[ií]as|tardes|noches)|qu[eé]\s*tal|c[oó]mo\s*est[aá]n)\b',
-            'productos': r'\b(productos?|cat[aá]logos?|ver\s*productos|milanesas?|ofertas?|qu[eé]\s*(tienen|ofrecen|venden)|tipos\s*de\s*milanesas|disponibles?|veganas?|vegetarianas?)\b',
-            'pedido': r'\b(pedidos?|[oó]rdenes?|estados?|seguimientos?|hice\s*un\s*pedido|cu[aá]ndo\s*llegar[aá]|pedido\s*[#]?\d+)\b',
-            'ayuda': r'\b(ayuda|soporte|problemas?|necesito\s*ayuda|consultas?|dudas?|preguntas?)\b',
-            'horarios': r'\b(horarios?|abiertos?|cerrados?|atenci[oó]n|hasta\s*qu[eé]\s*hora|qu[eé]\s*d[ií]as?|domingos?)\b',
-            'pago': r'\b(pagos?|formas?\s*de\s*pago|efectivo|tarjetas?|transferencias?|mercadopago|descuentos?|american\s*express|cr[eé]dito|d[eé]bito)\b',
-            'menu': r'\b(men[uú]s?|opciones|comandos|^[1-9]$)\b'  # Incluye números del 1-9 como opciones de menú
-        }
+
+        # Atajo para el caso más frecuente: una opción de menú numerada ("1".."9").
+        # Es exactamente lo que cubre `^[1-9]$` en el patrón de 'menu' y la fórmula
+        # de confianza le da 0.95, así que no hace falta pasar por el motor de regex.
+        if len(message) == 1 and '1' <= message <= '9':
+            return 'menu', 0.95
+
+        # Una sola pasada sobre el mensaje (Hyperscan si está disponible, si no `re`)
+        match_counts, match_lengths = _scan_intents(message)
         
         # Buscar coincidencias con mejor cálculo de confianza
         best_intent = None
         best_confidence = 0.0
         
-        for intent, pattern in intent_patterns.items():
-            matches = list(re.finditer(pattern, message.lower()))
-            if matches:
+        # Recorrer en el orden de INTENT_PATTERNS para conservar el desempate original
+        for intent in INTENT_PATTERNS:
+            match_count = match_counts.get(intent)
+            if match_count:
                 # Calcular confianza basada en la cantidad de coincidencias y su longitud total
-                total_match_length = sum(match.end() - match.start() for match in matches)
+                total_match_length = match_lengths[intent]
                 # Ajustamos la fórmula para dar más peso a múltiples coincidencias
-                match_count_factor = min(len(matches) * 0.1, 0.3)  # Máximo 0.3 por múltiples coincidencias
+                match_count_factor = min(match_count * 0.1, 0.3)  # Máximo 0.3 por múltiples coincidencias
                 length_factor = min((total_match_length / len(message)) * 0.6, 0.6)  # Máximo 0.6 por longitud
                 confidence = 0.3 + match_count_factor + length_factor  # Base 0.3 + factores
                 
                 # Limitar la confianza máxima a 0.95
                 confidence = min(confidence, 0.95)
                 
-                logger.debug(f"Intent '{intent}' detectado con confianza {confidence:.2f} (matches: {len(matches)}, longitud: {total_match_length})")
+                logger.debug(f"Intent '{intent}' detectado con confianza {confidence:.2f} (matches: {match_count}, longitud: {total_match_length})")
                 
                 # Guardar la mejor intención encontrada
                 if confidence > best_confidence:
@@ -3,16 +3,31 @@ Middleware para el bot de WhatsApp
 
 Este módulo proporciona middleware personalizado para manejar errores
 y realizar otras tareas a nivel de solicitud.
+
+Nota: ninguno de estos middlewares está registrado en settings.MIDDLEWARE, así
+que hoy no se ejecutan; el webhook (views.whatsapp_webhook) captura y registra
+sus propios errores. Para activarlos hay que añadirlos a MIDDLEWARE.
 """
 import logging
 import json
 import time
 from django.http import HttpResponse
-from twilio.twiml.messaging_response import MessagingResponse
-from .utils.error_handler import log_error, get_error_message
+from .utils.error_handler import ERROR_MESSAGES, log_error
+from .utils.twiml import twiml_bytes
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Fragmento de ruta que identifica las solicitudes del bot (p. ej. /webhook/whatsapp/)
+WHATSAPP_PATH_MARKER = '/whatsapp/'
+
+# Respuestas TwiML de error pre-renderizadas (equivalentes a MessagingResponse().message(...))
+_ERROR_TWIML_BY_KIND = {kind: twiml_bytes(message) for kind, message in ERROR_MESSAGES.items()}
+
 class WhatsAppErrorMiddleware:
     """
     Middleware para manejar errores en las solicitudes del bot de WhatsApp.
@@ -22,32 +37,32 @@ class WhatsAppErrorMiddleware:
         self.get_response = get_response
     
     def __call__(self, request):
+        # Solo manejar errores para rutas de WhatsApp; el resto pasa de largo
+        if WHATSAPP_PATH_MARKER not in request.path:
+            return self.get_response(request)
+        
         # Procesar la solicitud normalmente
         try:
             response = self.get_response(request)
             return response
         except Exception as e:
-            # Solo manejar errores para rutas de WhatsApp
-            if '/whatsapp/' in request.path:
-                logger.error(f"Error no manejado en la solicitud de WhatsApp: {str(e)}")
-                
-                # Registrar el error con contexto
-                context = {
-                    'path': request.path,
-                    'method': request.method,
-                    'POST': request.POST.dict() if request.method == 'POST' else {},
-                    'GET': request.GET.dict(),
-                }
-                log_error(e, context)
-                
-                # Crear respuesta de error de Twilio
-                twiml_response = MessagingResponse()
-                twiml_response.message(get_error_message('general'))
-                
-                return HttpResponse(str(twiml_response), content_type='text/xml')
-            else:
-                # Para otras rutas, dejar que Django maneje el error
-                raise
+            # Registrar el error (una sola vez, con su traza) con contexto: solo los campos de Twilio que interesan
+            post = request.POST if request.method == 'POST' else {}
+            context = {
+                'path': request.path,
+                'method': request.method,
+                'from': post.get('From'),
+                'sid': post.get('MessageSid'),
+                'body': (post.get('Body') or '')[:100],
+            }
+            # El volcado completo solo se arma si el nivel DEBUG está activo
+            if logger.isEnabledFor(logging.DEBUG):
+                context['POST'] = dict(request.POST.lists()) if post else {}
+                context['GET'] = dict(request.GET.lists())
+            log_error(e, context)
+            
+            # Respuesta de error de Twilio (TwiML ya renderizado)
+            return HttpResponse(_ERROR_TWIML_BY_KIND['general'], content_type='text/xml')
 
 class RequestLoggingMiddleware:
     """
@@ -57,29 +72,37 @@ class RequestLoggingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
     
+    # Campos del POST de Twilio que se registran (se omiten medios y demás)
+    LOGGED_POST_FIELDS = ('Body', 'From', 'To')
+    
     def __call__(self, request):
+        # Las rutas que no son de WhatsApp no se registran
+        if WHATSAPP_PATH_MARKER not in request.path:
+            return self.get_response(request)
+        
         # Registrar información de la solicitud
-        start_time = time.time()
+        start_time = time.perf_counter()
+        logger.info("Solicitud recibida: %s %s", request.method, request.path)
         
-        if '/whatsapp/' in request.path:
-            logger.info(f"Solicitud recibida: {request.method} {request.path}")
+        # Registrar datos de la solicitud para rutas de WhatsApp
+        # (solo si DEBUG está activo, para no serializar en producción)
+        if request.method == 'POST' and logger.isEnabledFor(logging.DEBUG):
+            # Evitar registrar información sensible: solo los campos necesarios
+            safe_post = {k: request.POST[k] for k in self.LOGGED_POST_FIELDS if k in request.POST}
+            if 'Body' in safe_post:
+                # Truncar el cuerpo del mensaje para evitar registrar mensajes largos
+                safe_post['Body'] = safe_post['Body'][:50] + ('...' if len(safe_post['Body']) > 50 else '')
             
-            # Registrar datos de la solicitud para rutas de WhatsApp
-            if request.method == 'POST':
-                # Evitar registrar información sensible
-                safe_post = request.POST.dict()
-                if 'Body' in safe_post:
-                    # Truncar el cuerpo del mensaje para evitar registrar mensajes largos
-                    safe_post['Body'] = safe_post['Body'][:50] + ('...' if len(safe_post['Body']) > 50 else '')
-                
-                logger.debug(f"Datos POST: {json.dumps(safe_post)}")
+            if orjson is not None:
+                logger.debug("Datos POST: %s", orjson.dumps(safe_post).decode())
+            else:
+                logger.debug("Datos POST: %s", json.dumps(safe_post))
         
         # Procesar la solicitud
         response = self.get_response(request)
         
         # Registrar información de la respuesta
-        if '/whatsapp/' in request.path:
-            duration = time.time() - start_time
-            logger.info(f"Respuesta enviada: {response.status_code} (tiempo: {duration:.3f}s)")
+        duration = time.perf_counter() - start_time
+        logger.info("Respuesta enviada: %s (tiempo: %.3fs)", response.status_code, duration)
         
         return response
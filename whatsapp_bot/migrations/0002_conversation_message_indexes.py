@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('phone_number', models.CharField(max_length=50, unique=True)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MessageTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('content', models.TextField()),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_state', models.CharField(choices=[('greeting', 'Saludo'), ('main_menu', 'Menú Principal'), ('browsing_products', 'Navegando Productos'), ('product_detail', 'Detalle de Producto'), ('adding_to_cart', 'Agregando al Carrito'), ('checkout', 'Proceso de Pago'), ('order_confirmation', 'Confirmación de Orden'), ('order_status', 'Estado de Orden'), ('customer_support', 'Atención al Cliente')], default='greeting', max_length=50)),
+                ('context_data', models.JSONField(blank=True, default=dict)),
+                ('active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_interaction', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='whatsapp_bot.customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('media_url', models.URLField(blank=True, null=True)),
+                ('direction', models.CharField(choices=[('inbound', 'Entrante'), ('outbound', 'Saliente')], max_length=10)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('delivered', models.BooleanField(default=False)),
+                ('read', models.BooleanField(default=False)),
+                ('whatsapp_message_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='whatsapp_bot.conversation')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['customer', 'active'], name='whatsapp_bo_custome_f1b6c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['last_interaction'], name='whatsapp_bo_last_in_0350e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp'], name='whatsapp_bo_convers_3c9872_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['whatsapp_message_id'], name='whatsapp_bo_whatsap_85927b_idx'),
+        ),
+    ]
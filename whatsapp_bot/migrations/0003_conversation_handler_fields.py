@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:51
+
+import django.db.models.deletion
+import whatsapp_bot.utils.json_codec
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_bot', '0002_conversation_message_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='handler_type',
+            field=models.CharField(choices=[('bot', 'Bot Handling'), ('human_requested', 'Human Support Requested'), ('human_active', 'Human Support Active'), ('resolved', 'Resolved')], default='bot', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_human_agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_conversations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='conversation',
+            name='context_data',
+            field=models.JSONField(blank=True, decoder=whatsapp_bot.utils.json_codec.OrjsonDecoder, default=dict, encoder=whatsapp_bot.utils.json_codec.OrjsonEncoder),
+        ),
+    ]
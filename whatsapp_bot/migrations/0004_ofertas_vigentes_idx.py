@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_bot', '0003_conversation_handler_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ofertaespecial',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['fecha_fin'], name='ofertas_vigentes_idx'),
+        ),
+    ]
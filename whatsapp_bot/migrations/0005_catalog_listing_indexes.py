@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_bot', '0004_ofertas_vigentes_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='categoria',
+            index=models.Index(fields=['activo', 'nombre'], name='categoria_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', 'nombre'], name='producto_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre'], include=('precio', 'stock', 'destacado'), name='producto_menu_idx'),
+        ),
+    ]
@@ -1,5 +1,30 @@
-from django.db import models
+import functools
+import re
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Now
 from django.utils import timezone
+from .utils.json_codec import OrjsonEncoder, OrjsonDecoder
+
+@functools.lru_cache(maxsize=128)
+def _placeholder_pattern(keys):
+    """Regex compilada que reconoce cualquiera de los placeholders {key} del contexto"""
+    return re.compile(r'\{(' + '|'.join(map(re.escape, keys)) + r')\}')
+
+def _render_placeholders(content, context):
+    """Reemplaza los placeholders {variable} con valores reales en una sola pasada"""
+    pattern = _placeholder_pattern(tuple(context))
+    return pattern.sub(lambda match: str(context[match.group(1)]), content)
+
+@functools.lru_cache(maxsize=512)
+def _render_cached(content, items):
+    """
+    Versión memorizada de _render_placeholders.
+    
+    La clave incluye el contenido de la plantilla, así que editarla y guardarla
+    produce una clave nueva sin necesidad de invalidar nada a mano.
+    """
+    return _render_placeholders(content, dict(items))
 
 class Categoria(models.Model):
     """Modelo para categorías de productos"""
@@ -13,10 +38,24 @@ class Categoria(models.Model):
         verbose_name = 'Categoría'
         verbose_name_plural = 'Categorías'
         ordering = ['nombre']
+        indexes = [
+            models.Index(fields=['activo', 'nombre'], name='categoria_activo_nombre_idx'),
+        ]
     
     def __str__(self):
         return self.nombre
 
+class ProductoQuerySet(models.QuerySet):
+    def disponibles(self):
+        """Productos disponibles (mismo criterio que Producto.esta_disponible), filtrados en la BD"""
+        return self.filter(activo=True, stock__gt=0)
+
+    def con_disponibilidad(self):
+        """Anota `disponible` (mismo criterio que Producto.esta_disponible), calculado en la BD"""
+        return self.annotate(disponible=models.ExpressionWrapper(
+            models.Q(activo=True, stock__gt=0), output_field=models.BooleanField()
+        ))
+
 class Producto(models.Model):
     """Modelo para productos"""
     nombre = models.CharField(max_length=200)
@@ -30,10 +69,23 @@ class Producto(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     
+    objects = ProductoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['nombre']
+        indexes = [
+            models.Index(fields=['activo', 'nombre'], name='producto_activo_nombre_idx'),
+            # Índice parcial y cubriente para el menú: en PostgreSQL el listado ordenado
+            # por nombre se resuelve con un index-only scan (INCLUDE se ignora en SQLite)
+            models.Index(
+                fields=['nombre'],
+                include=['precio', 'stock', 'destacado'],
+                condition=models.Q(activo=True),
+                name='producto_menu_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.nombre} - ${self.precio}"
@@ -42,6 +94,12 @@ class Producto(models.Model):
         """Verifica si el producto está disponible"""
         return self.activo and self.stock > 0
 
+class OfertaEspecialQuerySet(models.QuerySet):
+    def vigentes(self):
+        """Ofertas vigentes (mismo criterio que OfertaEspecial.esta_vigente), filtradas en la BD"""
+        ahora = timezone.now()
+        return self.filter(activo=True, fecha_inicio__lte=ahora, fecha_fin__gte=ahora)
+
 class OfertaEspecial(models.Model):
     """Modelo para ofertas especiales"""
     titulo = models.CharField(max_length=200)
@@ -53,10 +111,16 @@ class OfertaEspecial(models.Model):
     codigo = models.CharField(max_length=20, unique=True)
     activo = models.BooleanField(default=True)
     
+    objects = OfertaEspecialQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Oferta Especial'
         verbose_name_plural = 'Ofertas Especiales'
         ordering = ['-fecha_inicio']
+        indexes = [
+            # Índice parcial: vigentes() solo recorre ofertas activas por rango de fecha_fin
+            models.Index(fields=['fecha_fin'], condition=models.Q(activo=True), name='ofertas_vigentes_idx'),
+        ]
     
     def __str__(self):
         return self.titulo
@@ -76,6 +140,29 @@ class Customer(models.Model):
 	def __str__(self):
 		return f"{self.name} ({self.phone_number})"
 
+class ConversationQuerySet(models.QuerySet):
+	def active_for_phone(self, phone_number, recent_messages=0):
+		"""
+		Devuelve la conversación activa de un número (o None) junto con su cliente
+		y agente en la misma consulta.
+		
+		Args:
+			phone_number: Número del cliente, sin el prefijo whatsapp:
+			recent_messages: Si es mayor que 0, precarga esa cantidad de mensajes
+				recientes en `recent_messages` con una única consulta adicional
+		"""
+		queryset = self.select_related('customer', 'last_human_agent').filter(
+			customer__phone_number=phone_number,
+			active=True
+		)
+		if recent_messages:
+			queryset = queryset.prefetch_related(models.Prefetch(
+				'messages',
+				queryset=Message.objects.order_by('-timestamp')[:recent_messages],
+				to_attr='recent_messages'
+			))
+		return queryset.first()
+
 class Conversation(models.Model):
 	STATE_CHOICES = (
 		('greeting', 'Saludo'),
@@ -98,38 +185,81 @@ class Conversation(models.Model):
 	
 	customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='conversations')
 	current_state = models.CharField(max_length=50, choices=STATE_CHOICES, default='greeting')
-	context_data = models.JSONField(default=dict, blank=True)
+	context_data = models.JSONField(default=dict, blank=True, encoder=OrjsonEncoder, decoder=OrjsonDecoder)
+	handler_type = models.CharField(max_length=20, choices=HANDLER_CHOICES, default='bot')
+	last_human_agent = models.ForeignKey(
+		settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+		null=True, blank=True, related_name='assigned_conversations'
+	)
 	active = models.BooleanField(default=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 	last_interaction = models.DateTimeField(auto_now=True)
+	
+	objects = ConversationQuerySet.as_manager()
+	
+	class Meta:
+		indexes = [
+			models.Index(fields=['customer', 'active']),
+			models.Index(fields=['last_interaction']),
+		]
 
     
 	@property
 	def human_support_requested(self):
 		return self.handler_type == 'human_requested'
     
+	def _update_handler(self, filters=None, **values):
+		"""
+		Actualiza columnas de esta conversación con un único UPDATE, sin pasar por
+		save() ni sus señales; los timestamps los pone la base de datos con Now().
+		
+		Los campos indicados se reflejan también en la instancia en memoria (los
+		timestamps no, para no hacer una consulta extra).
+		
+		Returns:
+			True si se actualizó la fila
+		"""
+		updated = Conversation.objects.filter(pk=self.pk, **(filters or {})).update(
+			updated_at=Now(), last_interaction=Now(), **values
+		)
+		if updated:
+			for name, value in values.items():
+				setattr(self, name, value)
+		return bool(updated)
+    
 	def request_human_support(self):
-		if self.handler_type == 'bot':
-			self.handler_type = 'human_requested'
-			self.save()
-			# Create an entry in support queue
-			from admin_dashboard.models import SupportQueue
-			SupportQueue.objects.create(
-				conversation=self,
-				phone_number=self.phone_number
-			)
-			return True
-		return False
+		# Solo pasa a 'human_requested' si la fila sigue en 'bot' (evita dobles solicitudes)
+		if self.handler_type != 'bot':
+			return False
+		# El cambio de estado y la entrada en la cola se confirman juntos
+		try:
+			with transaction.atomic():
+				if not self._update_handler(filters={'handler_type': 'bot'}, handler_type='human_requested'):
+					return False
+				# Create an entry in support queue
+				from admin_dashboard.models import SupportQueue
+				SupportQueue.objects.create(
+					conversation=self,
+					phone_number=self.customer.phone_number
+				)
+		except IntegrityError:
+			# Ya hay una entrada abierta en la cola para esta conversación
+			# (uniq_open_queue_per_conv); el cambio de estado se revirtió
+			self.handler_type = 'bot'
+			return False
+		except Exception:
+			# Cualquier otro error también revierte la fila: la instancia debe
+			# coincidir con la BD para que un reintento no se tome como duplicado
+			self.handler_type = 'bot'
+			raise
+		return True
     
 	def assign_human_agent(self, agent):
-		self.handler_type = 'human_active'
-		self.last_human_agent = agent
-		self.save()
+		self._update_handler(handler_type='human_active', last_human_agent=agent)
     
 	def return_to_bot(self):
-		self.handler_type = 'bot'
-		self.save()
+		self._update_handler(handler_type='bot')
 	
 	def __str__(self):
 		return f"Conversación con {self.customer} - {self.current_state}"
@@ -154,6 +284,10 @@ class Message(models.Model):
 	
 	class Meta:
 		ordering = ['timestamp']
+		indexes = [
+			models.Index(fields=['conversation', 'timestamp']),
+			models.Index(fields=['whatsapp_message_id']),
+		]
 
 class MessageTemplate(models.Model):
 	name = models.CharField(max_length=100)
@@ -170,10 +304,9 @@ class MessageTemplate(models.Model):
 		if not context:
 			return self.content
 			
-		import re
-		rendered = self.content
-		# Reemplaza los placeholders {variable} con valores reales
-		for key, value in context.items():
-			pattern = r'\{' + key + r'\}'
-			rendered = re.sub(pattern, str(value), rendered)
-		return rendered
+		items = tuple(sorted(context.items()))
+		try:
+			return _render_cached(self.content, items)
+		except TypeError:
+			# Algún valor del contexto no es hashable: se renderiza sin caché
+			return _render_placeholders(self.content, context)
@@ -5,6 +5,9 @@ Este módulo contiene todos los valores constantes utilizados por los manejadore
 incluyendo nombres de estados, opciones de menú, palabras clave para detección de intenciones,
 y umbrales de confianza para la clasificación de mensajes.
 """
+import sys
+from types import MappingProxyType
+from ..utils.keywords import KeywordMatcher
 
 # Identificadores de opciones de menú
 MENU_VER_PRODUCTOS = '1'
@@ -28,89 +31,83 @@ ESTADO_CHECKOUT = 'checkout'
 ESTADO_ESTADO_PEDIDO = 'estado_pedido'
 ESTADO_CONFIRMACION_PEDIDO = 'confirmacion_pedido'
 ESTADO_OFERTAS_ESPECIALES = 'ofertas_especiales'
-
-# Palabras clave para saludos simples
-PALABRAS_SALUDO = [
-    'hola', 'buenas', 'buenos días', 'buenas tardes', 'buenas noches', 'saludos',
-    'hey', 'ey', 'hi', 'hello', 'ola', 'que tal', 'qué tal', 'como va', 'cómo va'
-]
 ESTADO_ATENCION_CLIENTE = 'atencion_cliente'
 
+# Las palabras clave se escriben sin acentos: los mensajes se comparan después de
+# pasar por utils.text.normalize, que los quita (así "menú" y "menu" coinciden).
+
 # Palabras clave de saludo con variaciones expandidas
-PALABRAS_SALUDO = [
-    'hola', 'buen día', 'buen dia', 'buenos días', 'buenos dias', 
-    'buenas tardes', 'buenas noches', 'qué tal', 'que tal', 'cómo va', 'como va', 
-    'qué onda', 'que onda', 'holis', 'saludos'
-]
+PALABRAS_SALUDO = (
+    'hola', 'buen dia', 'buenos dias', 'buenas tardes', 'buenas noches',
+    'que tal', 'como va', 'que onda', 'holis', 'saludos'
+)
 
 # Grupos de palabras clave para navegación
 # Menú principal y palabras clave de navegación
-PALABRAS_MENU_PRINCIPAL = [
-    'menu', 'menú', 'principal', 'volver al menú', 'volver al menu',
-    'menú principal', 'menu principal', 'inicio', 'volver'
-]
+PALABRAS_MENU_PRINCIPAL = (
+    'menu', 'principal', 'volver al menu', 'menu principal', 'inicio', 'volver'
+)
 
 # Grupos de palabras clave para reconocimiento de intenciones con variaciones expandidas
-PALABRAS_VER_PRODUCTOS = [
-    'ver producto', 'ver productos', 'productos', 'catalogo', 'catálogo', 'milanesas', 
-    'que tenés para vender', 'que tenes para vender', 'mostrame los productos',
-    'quiero ver productos', 'quisiera ver productos', 'menú de productos', 'menu de productos', 
-    'que vendés', 'que vendes', 'mostrame las opciones'
-]
-
-PALABRAS_HACER_PEDIDO = [
+PALABRAS_VER_PRODUCTOS = (
+    'ver producto', 'ver productos', 'productos', 'catalogo', 'milanesas', 
+    'que tenes para vender', 'mostrame los productos',
+    'quiero ver productos', 'quisiera ver productos', 'menu de productos', 
+    'que vendes', 'mostrame las opciones'
+)
+
+PALABRAS_HACER_PEDIDO = (
     'hacer pedido', 'hacer un pedido', 'quiero comprar', 'quisiera comprar',
     'quiero pedir', 'quisiera pedir', 'quiero ordenar', 'quisiera ordenar',
-    'realizar pedido', 'realizar compra', 'me gustaría comprar', 'me gustaria comprar', 
-    'me gustaría pedir', 'me gustaria pedir'
-]
+    'realizar pedido', 'realizar compra', 'me gustaria comprar', 'me gustaria pedir'
+)
 
-PALABRAS_ESTADO_PEDIDO = [
+PALABRAS_ESTADO_PEDIDO = (
     'consultar estado', 'estado de mi pedido', 'seguimiento de pedido', 'mi pedido', 
-    'donde está mi pedido', 'donde esta mi pedido', 'cuando llega mi pedido', 
-    'cuándo llega mi pedido', 'tracking de mi pedido', 'rastreo de pedido',
-    'revisar pedido', 'cómo va mi pedido', 'como va mi pedido', 
+    'donde esta mi pedido', 'cuando llega mi pedido', 
+    'tracking de mi pedido', 'rastreo de pedido',
+    'revisar pedido', 'como va mi pedido', 
     'estado de mi compra', 'estado de mi orden'
-]
+)
 
-PALABRAS_OFERTAS_ESPECIALES = [
+PALABRAS_OFERTAS_ESPECIALES = (
     'ofertas', 'promociones', 'descuentos', 'ofertas especiales', 'promociones especiales',
-    'promo', 'combos especiales', 'paquetes con descuento', 'liquidación', 'liquidacion',
-    'ofertas del día', 'ofertas del dia', 'promociones del día', 'promociones del dia',
+    'promo', 'combos especiales', 'paquetes con descuento', 'liquidacion',
+    'ofertas del dia', 'promociones del dia',
     'hay descuentos', 'tienen ofertas'
-]
+)
 
-PALABRAS_ATENCION_CLIENTE = [
-    'atención al cliente', 'atencion al cliente', 'servicio al cliente', 
+PALABRAS_ATENCION_CLIENTE = (
+    'atencion al cliente', 'servicio al cliente', 
     'hablar con alguien', 'hablar con una persona', 'hablar con un representante',
     'necesito ayuda', 'tengo un problema', 'tengo una duda', 'tengo una pregunta',
     'quiero hablar con un humano', 'quiero hablar con una persona', 
-    'contactar con soporte', 'contactar con atención'
-]
+    'contactar con soporte', 'contactar con atencion'
+)
 
 # Palabras clave de navegación
-PALABRAS_VOLVER = [
-    'volver atrás', 'volver atras', 'ir atrás', 'ir atras', 'regresar',
-    'volver a categorías', 'volver a categorias', 'atrás', 'atras'
-]
+PALABRAS_VOLVER = (
+    'volver atras', 'ir atras', 'regresar',
+    'volver a categorias', 'atras'
+)
 
 # Palabras clave de carrito y checkout
-PALABRAS_CARRITO = [
+PALABRAS_CARRITO = (
     'carrito', 'ver carrito', 'mi carrito', 'ver mi carrito', 'finalizar compra', 
     'terminar compra', 'proceder al pago', 'ir a pagar', 'revisar carrito', 
     'revisar mi carrito', 'checkout', 'ver mis productos'
-]
+)
 
 # Palabras clave de confirmación
-PALABRAS_CONFIRMAR = [
-    'confirmar', 'si', 'sí', 'aceptar', 'confirmar pedido', 'confirmar compra',
+PALABRAS_CONFIRMAR = (
+    'confirmar', 'si', 'aceptar', 'confirmar pedido', 'confirmar compra',
     'estoy de acuerdo', 'me parece bien', 'ok', 'okay', 'dale', 'listo'
-]
+)
 
-PALABRAS_CANCELAR = [
+PALABRAS_CANCELAR = (
     'cancelar', 'no', 'rechazar', 'cancelar pedido', 'cancelar compra',
     'no quiero', 'no me interesa', 'no gracias', 'mejor no'
-]
+)
 
 # Mensajes predefinidos
 MENSAJE_BIENVENIDA = (
@@ -347,26 +344,46 @@ MENSAJE_ERROR = (
 )
 
 # Opciones de menú numeradas
-OPCIONES_MENU_NUMERADAS = {
+OPCIONES_MENU_NUMERADAS = MappingProxyType({
     'ver_productos': '1',
     'hacer_pedido': '2',
     'consultar_estado': '3',
     'ofertas_especiales': '4',
     'atencion_cliente': '5'
-}
+})
 
 # Mapeo de intenciones a estados
-MAPEO_INTENCION_ESTADO = {
+# Se mantiene como diccionario (no match/case): en CPython un match con literales de
+# str se compila como comparaciones sucesivas, mientras que .get() es un único hash
+MAPEO_INTENCION_ESTADO = MappingProxyType({
     'saludo': ESTADO_SALUDO,
     'ver_productos': ESTADO_NAVEGANDO_PRODUCTOS,
     'hacer_pedido': ESTADO_AGREGANDO_AL_CARRITO,
     'consultar_estado': ESTADO_ESTADO_PEDIDO,
     'ofertas_especiales': ESTADO_OFERTAS_ESPECIALES,
     'atencion_cliente': ESTADO_ATENCION_CLIENTE
-}
+})
+
+# Palabras clave por intención (fuente del matcher de intenciones, en orden de prioridad)
+PALABRAS_POR_INTENCION = MappingProxyType({
+    'saludo': PALABRAS_SALUDO,
+    'ver_productos': PALABRAS_VER_PRODUCTOS,
+    'hacer_pedido': PALABRAS_HACER_PEDIDO,
+    'consultar_estado': PALABRAS_ESTADO_PEDIDO,
+    'ofertas_especiales': PALABRAS_OFERTAS_ESPECIALES,
+    'atencion_cliente': PALABRAS_ATENCION_CLIENTE,
+})
+
+# Intención que devuelve el detector cuando no reconoce el mensaje. ConversationHandler
+# la compara con `is`; está internada, igual que las intenciones que recibe de fuera
+INTENCION_DESCONOCIDA = sys.intern('desconocido')
+
+# Comandos de navegación que vuelven al menú anterior (mensaje completo, ya limpio).
+# Se comprueban con una sola búsqueda en el conjunto, sin importar cuántos haya
+COMANDOS_VOLVER = frozenset({'volver'})
 
 # Intenciones por defecto para detección
-INTENCIONES_PREDETERMINADAS = [
+INTENCIONES_PREDETERMINADAS = (
     'saludo',
     'ver_productos',
     'hacer_pedido',
@@ -376,4 +393,47 @@ INTENCIONES_PREDETERMINADAS = [
     'cancelar_pedido',
     'pregunta_pago',
     'pregunta_producto'
-]
+)
+
+# Versiones en conjunto de las palabras clave que se comprueban como mensaje completo
+# (saludos en TwilioWhatsAppService, volver en CustomerSupportService), en O(1); las
+# listas se mantienen para las búsquedas por subcadena y el matcher.
+def _keyword_set(keywords):
+    return frozenset(sys.intern(keyword.lower()) for keyword in keywords)
+
+PALABRAS_SALUDO_SET = _keyword_set(PALABRAS_SALUDO)
+PALABRAS_VOLVER_SET = _keyword_set(PALABRAS_VOLVER)
+
+# Todos los grupos de palabras clave, para clasificar un mensaje con una sola pasada
+PALABRAS_POR_GRUPO = MappingProxyType({
+    **PALABRAS_POR_INTENCION,
+    'menu_principal': PALABRAS_MENU_PRINCIPAL,
+    'volver': PALABRAS_VOLVER,
+    'carrito': PALABRAS_CARRITO,
+    'confirmar': PALABRAS_CONFIRMAR,
+    'cancelar': PALABRAS_CANCELAR,
+})
+
+KEYWORD_MATCHER = KeywordMatcher(PALABRAS_POR_GRUPO)
+
+
+def classify(message: str) -> set:
+    """
+    Devuelve los grupos de PALABRAS_POR_GRUPO con alguna palabra clave contenida en el
+    mensaje (equivale a `any(k in message for k in PALABRAS_...)` por cada grupo).
+
+    Args:
+        message: Mensaje ya normalizado con utils.text.normalize
+    """
+    return KEYWORD_MATCHER.classify(message)
+
+# Mensajes predefinidos, cuyo TwiML se renderiza al importar utils.twiml
+MENSAJES_PREDEFINIDOS = (
+    MENSAJE_BIENVENIDA, MENSAJE_MENU_PRINCIPAL, MENSAJE_VER_PRODUCTOS,
+    MENSAJE_PRODUCTOS_POR_CATEGORIAS, MENSAJE_MILANESAS, MENSAJE_CONGELADOS,
+    MENSAJE_ACOMPAÑAMIENTOS, MENSAJE_PROMOCIONES_GENERALES, MENSAJE_COMBOS_SIN_GLUTEN,
+    MENSAJE_CONGELADOS_GUARNICIONES, MENSAJE_FORMAS_PAGO, MENSAJE_TARTAS, MENSAJE_PIZZAS,
+    MENSAJE_HACER_PEDIDO, MENSAJE_CONSULTA_ZONA, MENSAJE_MONTO_MINIMO, MENSAJE_NO_ESTOY,
+    MENSAJE_MANIPULACION, MENSAJE_RECETAS, MENSAJE_ATENCION_CLIENTE,
+    MENSAJE_CONSULTAR_ESTADO, MENSAJE_OFERTAS_ESPECIALES, MENSAJE_NO_ENTIENDO, MENSAJE_ERROR,
+)
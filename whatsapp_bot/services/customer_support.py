@@ -8,41 +8,53 @@ import logging
 import re
 from typing import Dict, Any, Optional, List, Tuple
 from django.conf import settings
+from ..utils.text import normalize
+from ..utils.keywords import KeywordMatcher
 from .constants import (
-    PALABRAS_ATENCION_CLIENTE, PALABRAS_VOLVER,
+    PALABRAS_ATENCION_CLIENTE, PALABRAS_VOLVER_SET, classify,
     ESTADO_ATENCION_CLIENTE, ESTADO_MENU_PRINCIPAL,
     MENSAJE_ATENCION_CLIENTE
 )
 
 logger = logging.getLogger(__name__)
 
+# Separa un mensaje en palabras
+TOKEN_RE = re.compile(r'\w+')
+
+# Palabras sueltas que siempre vuelven al menú principal (las que sugiere SUPPORT_FOOTER)
+MENU_QUICK_WORDS = frozenset({'menu', 'volver', 'atras', 'inicio'})
+
+# Pie que se agrega a las respuestas de soporte
+SUPPORT_FOOTER = "\n\nPara volver al menú principal, escribe 'menu' o 'volver'."
+
 class CustomerSupportService:
     """
     Servicio para gestionar consultas de atención al cliente y proporcionar
     respuestas apropiadas para el bot de WhatsApp.
     """
     
-    # Categorías de soporte comunes y sus palabras clave
+    # Categorías de soporte comunes y sus palabras clave (sin acentos: el mensaje se
+    # normaliza con utils.text.normalize antes de buscarlas)
     SUPPORT_CATEGORIES = {
         'pedido': [
             'pedido', 'orden', 'compra', 'tracking', 'seguimiento', 
             'estado', 'cancelar', 'modificar', 'cambiar'
         ],
         'producto': [
-            'producto', 'calidad', 'ingredientes', 'alérgenos', 'alergenos',
-            'conservación', 'conservacion', 'caducidad', 'vencimiento'
+            'producto', 'calidad', 'ingredientes', 'alergenos',
+            'conservacion', 'caducidad', 'vencimiento'
         ],
         'pago': [
             'pago', 'factura', 'recibo', 'tarjeta', 'efectivo', 'transferencia',
-            'mercadopago', 'reembolso', 'devolucion', 'devolución'
+            'mercadopago', 'reembolso', 'devolucion'
         ],
         'envio': [
-            'envío', 'envio', 'delivery', 'entrega', 'dirección', 'direccion',
+            'envio', 'delivery', 'entrega', 'direccion',
             'domicilio', 'tiempo', 'demora', 'retraso'
         ],
         'horario': [
-            'horario', 'abierto', 'cerrado', 'atención', 'atencion',
-            'disponibilidad', 'días', 'dias', 'horas'
+            'horario', 'abierto', 'cerrado', 'atencion',
+            'disponibilidad', 'dias', 'horas'
         ],
         'reclamo': [
             'reclamo', 'queja', 'problema', 'error', 'incidencia', 'incidente',
@@ -108,6 +120,21 @@ class CustomerSupportService:
         )
     }
     
+    # Respuestas finales (con el pie para volver al menú) compuestas una sola vez
+    SUPPORT_RESPONSES_FINAL = {
+        category: response + SUPPORT_FOOTER for category, response in SUPPORT_RESPONSES.items()
+    }
+    
+    # Confianza según el número de coincidencias, precalculada para cada valor
+    # posible: más coincidencias = mayor confianza, hasta un máximo de 0.9
+    _CONFIDENCE_BY_COUNT = tuple(
+        min(0.9, 0.3 + (match_count * 0.15))
+        for match_count in range(max(map(len, SUPPORT_CATEGORIES.values())) + 1)
+    )
+    
+    # Matcher de palabras clave por categoría, construido una sola vez
+    _CATEGORY_MATCHER = KeywordMatcher(SUPPORT_CATEGORIES)
+    
     @classmethod
     def detect_support_category(cls, message: str) -> Tuple[str, float]:
         """
@@ -119,29 +146,20 @@ class CustomerSupportService:
         Returns:
             Tupla con la categoría detectada y la puntuación de confianza
         """
-        message = message.lower()
-        
-        # Contar coincidencias para cada categoría
-        category_matches = {}
-        for category, keywords in cls.SUPPORT_CATEGORIES.items():
-            matches = sum(1 for keyword in keywords if keyword in message)
-            if matches > 0:
-                category_matches[category] = matches
-        
+        return cls._score_category(cls._CATEGORY_MATCHER.find(normalize(message)))
+    
+    @classmethod
+    def _score_category(cls, found: Dict[str, Any]) -> Tuple[str, float]:
+        """Elige la categoría con más palabras clave distintas y calcula la confianza"""
         # Si no hay coincidencias, devolver categoría por defecto
-        if not category_matches:
+        if not found:
             return ('default', 0.1)
         
-        # Encontrar la categoría con más coincidencias
-        best_category = max(category_matches.items(), key=lambda x: x[1])
-        category_name = best_category[0]
-        match_count = best_category[1]
-        
-        # Calcular puntuación de confianza basada en el número de coincidencias
-        # Más coincidencias = mayor confianza, hasta un máximo de 0.9
-        confidence = min(0.9, 0.3 + (match_count * 0.15))
+        # Encontrar la categoría con más coincidencias (palabras clave distintas);
+        # en empate gana la primera declarada
+        category_name = max(found, key=lambda category: len(found[category]))
         
-        return (category_name, confidence)
+        return (category_name, cls._CONFIDENCE_BY_COUNT[len(found[category_name])])
     
     @classmethod
     def get_support_response(cls, message: str) -> str:
@@ -158,17 +176,15 @@ class CustomerSupportService:
             # Detectar categoría de soporte
             category, confidence = cls.detect_support_category(message)
             
-            # Obtener respuesta predefinida para la categoría
-            response = cls.SUPPORT_RESPONSES.get(category, cls.SUPPORT_RESPONSES['default'])
-            
-            # Agregar mensaje para volver al menú principal
-            response += "\n\nPara volver al menú principal, escribe 'menu' o 'volver'."
+            # Obtener respuesta predefinida para la categoría (ya incluye el pie
+            # para volver al menú principal)
+            response = cls.SUPPORT_RESPONSES_FINAL.get(category, cls.SUPPORT_RESPONSES_FINAL['default'])
             
-            logger.info(f"Categoría de soporte detectada: {category} con confianza {confidence:.2f}")
+            logger.info("Categoría de soporte detectada: %s con confianza %.2f", category, confidence)
             return response
             
         except Exception as e:
-            logger.error(f"Error al generar respuesta de soporte: {str(e)}")
+            logger.error("Error al generar respuesta de soporte: %s", e)
             return (
                 "Lo siento, ocurrió un error al procesar tu consulta. "
                 "Por favor, intenta nuevamente o escribe 'menu' para volver al menú principal."
@@ -185,5 +201,11 @@ class CustomerSupportService:
         Returns:
             True si el usuario quiere volver al menú, False en caso contrario
         """
-        message = message.lower()
-        return any(keyword in message for keyword in PALABRAS_VOLVER)
+        message = normalize(message.strip())
+        # Camino rápido: la mayoría de las respuestas son una sola palabra de menú
+        if message in MENU_QUICK_WORDS or message in PALABRAS_VOLVER_SET:
+            return True
+        # Intersección de conjuntos en C: resuelve las palabras clave de una sola palabra
+        if not PALABRAS_VOLVER_SET.isdisjoint(TOKEN_RE.findall(message)):
+            return True
+        return 'volver' in classify(message)
@@ -1,7 +1,28 @@
 # Initialize handlers package
-from .base_handler import BaseConversationHandler
-from .chatbot_handler import ChatbotHandler
-from .conversation_handler import ConversationHandler
-from .twilio_ai_handler import TwilioAIHandler
+# Los manejadores se importan al primer acceso (PEP 562), para no cargar todos los
+# módulos (y sus dependencias) cuando solo se usa uno
+import importlib
 
-__all__ = ['BaseConversationHandler', 'ChatbotHandler', 'ConversationHandler', 'TwilioAIHandler']
+_LAZY_IMPORTS = {
+    'BaseConversationHandler': '.base_handler',
+    'ChatbotHandler': '.chatbot_handler',
+    'get_chatbot_handler': '.chatbot_handler',
+    'ConversationHandler': '.conversation_handler',
+    'TwilioAIHandler': '.twilio_ai_handler',
+}
+
+__all__ = ['BaseConversationHandler', 'ChatbotHandler', 'ConversationHandler', 'TwilioAIHandler',
+           'get_chatbot_handler']
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
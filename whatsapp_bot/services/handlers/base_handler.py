@@ -5,11 +5,74 @@ Este módulo proporciona la clase BaseConversationHandler que sirve como base
 para todos los manejadores de conversación en el bot de WhatsApp.
 """
 import logging
+import sys
+import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
+# Tiempo de vida de los estados de usuario (segundos), en memoria y en la caché de Django
+USER_STATE_TIMEOUT = 3600
+
+
+class _UserStateCache:
+    """
+    Caché LRU en memoria con tiempo de vida para los estados de usuario.
+    
+    Guarda, por usuario, el estado y el momento en que se escribió en la caché de
+    Django, para poder evitar escrituras repetidas del mismo estado. Los estados se
+    internan: son unos pocos valores repetidos en miles de entradas, y los que llegan
+    desde la caché de Django son copias nuevas de cada cadena.
+    """
+    
+    __slots__ = ('maxsize', 'ttl', '_data')
+    
+    def __init__(self, maxsize: int = 10000, ttl: int = USER_STATE_TIMEOUT):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+    
+    def get_entry(self, key: str):
+        """Devuelve (estado, momento de escritura) o None si no existe o expiró"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+    
+    def get(self, key: str, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get_entry(key) is not None
+    
+    def __getitem__(self, key: str):
+        entry = self.get_entry(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+    
+    def __setitem__(self, key: str, state: str) -> None:
+        if type(state) is str:
+            state = sys.intern(state)
+        self._data[key] = (state, time.monotonic())
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __repr__(self) -> str:
+        return repr({key: entry[0] for key, entry in self._data.items()})
+
+
 class BaseConversationHandler:
     """
     Clase base para manejadores de conversación.
@@ -19,15 +82,17 @@ class BaseConversationHandler:
     # Definir el estado predeterminado a nivel de clase para que sea accesible globalmente
     _default_state = "menu_principal"
     
+    # Estados de usuario en memoria, compartidos por todas las instancias: delante de
+    # la caché de Django, que solo se consulta si el usuario no está aquí
+    _user_states = _UserStateCache()
+    
     def __init__(self):
         """
         Inicializa la clase base con estructuras para gestionar estados de usuario
         """
-        # Inicializar el diccionario de estados de usuario en memoria
-        self._user_states = {}
         # Establecer el estado predeterminado (no cambiar el valor, solo asegurar acceso desde la instancia)
         # self._default_state ya está definido a nivel de clase
-        logger.info(f"BaseConversationHandler inicializado con estado predeterminado: {self._default_state}")
+        logger.info("BaseConversationHandler inicializado con estado predeterminado: %s", self._default_state)
         
     def _get_user_state(self, user_id: str) -> str:
         """
@@ -39,10 +104,6 @@ class BaseConversationHandler:
         Returns:
             El estado actual del usuario o un estado predeterminado si no existe
         """
-        # Asegurarnos de que _user_states esté inicializado
-        if not hasattr(self, '_user_states'):
-            self._user_states = {}
-            
         # Determinar el estado predeterminado (priorizar el que establece la subclase)
         default_state = getattr(self, '_default_state', "menu_principal")  # Cambiado para usar menu_principal por defecto
             
@@ -61,9 +122,9 @@ class BaseConversationHandler:
         # Si no hay estado en ninguna caché, inicializar con el estado por defecto
         # Guardar el estado por defecto en ambas cachés
         self._user_states[user_id] = default_state
-        cache.set(cache_key, default_state, 3600)  # 1 hora de timeout
+        cache.set(cache_key, default_state, USER_STATE_TIMEOUT)
         
-        logger.info(f"Inicializando estado para usuario {user_id}: {default_state}")
+        logger.info("Inicializando estado para usuario %s: %s", user_id, default_state)
         return default_state
         
     def _set_user_state(self, from_number: str, state: str) -> None:
@@ -74,14 +135,22 @@ class BaseConversationHandler:
             from_number: El número de teléfono del usuario
             state: El nuevo estado del usuario
         """
-        logger.info(f"Cambiando estado del usuario {from_number}: {state}")
+        logger.info("Cambiando estado del usuario %s: %s", from_number, state)
+        
+        # Si el estado no cambia y se escribió hace menos de la mitad del tiempo de
+        # vida, no hace falta volver a escribirlo en la caché de Django
+        states = self._user_states
+        if isinstance(states, _UserStateCache):
+            entry = states.get_entry(from_number)
+            if entry is not None and entry[0] == state and time.monotonic() - entry[1] < USER_STATE_TIMEOUT / 2:
+                return
         
         # Guardar en memoria
-        self._user_states[from_number] = state
+        states[from_number] = state
         
         # Guardar en caché
         cache_key = f"user_state_{from_number}"
-        cache.set(cache_key, state, timeout=3600)  # 1 hora de timeout
+        cache.set(cache_key, state, timeout=USER_STATE_TIMEOUT)
     
     def process_message(self, from_number: str, message: str, 
                         intent: Optional[str] = None, 
@@ -4,9 +4,14 @@ Manejador de Chatbot
 Este módulo proporciona la clase ChatbotHandler que maneja las respuestas básicas
 del chatbot para intenciones conocidas.
 """
+import contextlib
+import functools
 import logging
 import json
-from typing import Dict, Optional, Callable, Any
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Optional, Callable, Any, Mapping, Tuple
 
 from django.core.cache import cache
 
@@ -42,143 +47,263 @@ from whatsapp_bot.services.constants import (
     ESTADO_ESTADO_PEDIDO, 
     ESTADO_OFERTAS_ESPECIALES,
     ESTADO_ATENCION_CLIENTE, 
-    MAPEO_INTENCION_ESTADO
+    MAPEO_INTENCION_ESTADO,
+    COMANDOS_VOLVER
 )
-from .base_handler import BaseConversationHandler
+from ...utils.text import normalize
+from .base_handler import BaseConversationHandler, _UserStateCache
 
 logger = logging.getLogger(__name__)
 
+# Opciones de menú de un dígito: la entrada más frecuente, se reconoce sin más procesamiento
+_NUMERIC_OPTIONS = frozenset("123456789")
+
+# Copia en memoria de los estados leídos de la caché de Django, con un tiempo de vida
+# corto: ahorra la consulta al backend cuando el mismo usuario escribe varias veces
+# seguidas, y como expira en segundos ve pronto los cambios hechos por otros procesos
+USER_STATE_L1_TTL = 5
+_l1_states = _UserStateCache(maxsize=4096, ttl=USER_STATE_L1_TTL)
+_l1_lock = threading.Lock()
+
+# Estados escritos por este proceso en la última hora. Si un mensaje deja al usuario
+# en el mismo estado que leyó y este proceso ya lo escribió hace menos de una hora, no
+# hace falta volver a escribirlo (la entrada de la caché dura 24 horas)
+USER_STATE_REFRESH_INTERVAL = 3600
+_recent_writes = _UserStateCache(maxsize=4096, ttl=USER_STATE_REFRESH_INTERVAL)
+
+
+# Respuesta para una opción que no existe en el menú actual
+_OPCION_NO_DISPONIBLE = "La opción {option} no está disponible en este menú. Por favor, selecciona una opción válida."
+
+
+@functools.lru_cache(maxsize=32)
+def _invalid_option_message(option: str) -> str:
+    """Mensaje de opción no disponible; las opciones erróneas se repiten ("0", "6", ...)"""
+    return _OPCION_NO_DISPONIBLE.format(option=option)
+
+
+@dataclass(slots=True)
+class _StateCtx:
+    """Estado de un usuario durante el procesamiento de un mensaje"""
+    from_number: str
+    state: Optional[str] = None
+    dirty: bool = False
+    # Estado leído de la caché al empezar (None si no se leyó o no había)
+    loaded: Optional[str] = None
+    # Qué se hizo con el mensaje, para el registro único al terminar
+    events: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(slots=True, frozen=True)
+class _OptionEntry:
+    """Opción numérica de un estado: manejador y estado siguiente"""
+    handler: Callable
+    next_state: Optional[str] = None
+
+
+@dataclass(slots=True, frozen=True)
+class _StateNode:
+    """Configuración de un estado: opciones numéricas, manejador por defecto y vuelta atrás"""
+    default: Optional[Callable] = None
+    options: Mapping[str, _OptionEntry] = field(default_factory=dict)
+    back_handler: Optional[Callable] = None
+    back_state: Optional[str] = None
+    # Opciones de un dígito indexadas por su valor (0-9): tabla de salto sin hashing
+    options_arr: Tuple[Optional[_OptionEntry], ...] = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        options_arr = [None] * 10
+        for option, entry in self.options.items():
+            if len(option) == 1 and '0' <= option <= '9':
+                options_arr[ord(option) - 48] = entry
+        object.__setattr__(self, 'options_arr', tuple(options_arr))
+
+
 class ChatbotHandler(BaseConversationHandler):
     """
     Manejador de chatbot que proporciona respuestas para intenciones conocidas.
     Implementa un sistema de estados para gestionar el flujo de conversación.
     """
     
+    # Respuesta de cada intención explícita: (estado siguiente o None, mensaje).
+    # Son respuestas fijas, así que no hace falta pasar por un método manejador.
+    # La tabla se comparte entre instancias: es de solo lectura.
+    INTENT_RESPONSES = MappingProxyType({
+        'saludo': ('menu_principal', MENSAJE_BIENVENIDA),
+        'ver_productos': ('menu_productos', MENSAJE_VER_PRODUCTOS),
+        'hacer_pedido': ('menu_delivery', MENSAJE_HACER_PEDIDO),
+        'consultar_estado': (None, MENSAJE_CONSULTAR_ESTADO),
+        'ofertas_especiales': (None, MENSAJE_OFERTAS_ESPECIALES),
+        'atencion_cliente': (None, MENSAJE_ATENCION_CLIENTE),
+    })
+    
+    # Jerarquía de navegación del menú: padre de cada estado y mensaje que se muestra
+    # al volver a él. Es fija, así que se construye una sola vez y es de solo lectura.
+    MENU_HIERARCHY = MappingProxyType({
+        # Nivel 1: Menú principal y sus opciones directas
+        "menu_principal": {
+            "parent": None,  # No tiene padre, es el nivel superior
+            "message": MENSAJE_MENU_PRINCIPAL
+        },
+        
+        # Nivel 2: Submenús principales que dependen del menú principal
+        "menu_productos": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Ver productos
+        "menu_delivery": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Hacer pedido
+        "menu_manipulacion": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Manipulación
+        "menu_recetas": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Recetas
+        "menu_atencion": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Atención al cliente
+        
+        # Nivel 3: Opciones del menú de productos
+        "menu_categorias": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Categorías
+        "menu_promociones_generales": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Promociones
+        "menu_combos_sin_gluten": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Combos
+        "menu_congelados_guarniciones": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Congelados
+        "menu_formas_pago": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Formas de pago
+        
+        # Nivel 4: Categorías de productos
+        "menu_milanesas": {"parent": "menu_categorias", "message": MENSAJE_PRODUCTOS_POR_CATEGORIAS},  # Milanesas
+        "menu_congelados": {"parent": "menu_categorias", "message": MENSAJE_PRODUCTOS_POR_CATEGORIAS},  # Congelados
+        
+        # Nivel 5: Opciones de congelados
+        "menu_acompanamientos": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Acompañamientos
+        "menu_tartas": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Tartas individuales
+        "menu_pizzas": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Pizzas masa madre
+        
+        # Nivel 3: Opciones del menú de delivery
+        "menu_consulta_zona": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # Consultar zona
+        "menu_monto_minimo": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # Monto mínimo
+        "menu_no_estoy": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # No estoy en CABA
+    })
+    
+    # Padre de cada estado que lo tiene, derivado de MENU_HIERARCHY: una sola búsqueda
+    _PARENT_OF = MappingProxyType({
+        state: node["parent"] for state, node in MENU_HIERARCHY.items() if node["parent"]
+    })
+    
     def __init__(self):
         """Inicializa el manejador de chatbot con mapeos de estados y opciones"""
         # Inicializar la clase base primero para configurar la gestión de estados
         super().__init__()
         
-        # Asegurar que el estado predeterminado sea 'menu_principal'
-        self._default_state = "menu_principal"
-        # Estructura de estados y transiciones
+        # El estado predeterminado ('menu_principal') lo hereda de la clase base
+        
+        # Estado del usuario del mensaje en curso (uno por hilo: la instancia se comparte)
+        self._local = threading.local()
+        
+        # Estructura de estados y transiciones (con métodos enlazados: por instancia)
         self.state_handlers = {
             # Estado inicial y menú principal
-            'initial': {
-                'default': self._handle_greeting,
-                'next_state': 'menu_principal'
-            },
-            'menu_principal': {
-                'options': {
-                    '1': {'handler': self._handle_view_products, 'next_state': 'menu_productos'},
-                    '2': {'handler': self._handle_make_order, 'next_state': 'menu_delivery'},
-                    '3': {'handler': self._handle_manipulacion, 'next_state': 'menu_manipulacion'},
-                    '4': {'handler': self._handle_recetas, 'next_state': 'menu_recetas'},
-                    '5': {'handler': self._handle_customer_support, 'next_state': 'menu_atencion'}
+            'initial': _StateNode(
+                default=self._handle_greeting
+            ),
+            'menu_principal': _StateNode(
+                options={
+                    '1': _OptionEntry(self._handle_view_products, 'menu_productos'),
+                    '2': _OptionEntry(self._handle_make_order, 'menu_delivery'),
+                    '3': _OptionEntry(self._handle_manipulacion, 'menu_manipulacion'),
+                    '4': _OptionEntry(self._handle_recetas, 'menu_recetas'),
+                    '5': _OptionEntry(self._handle_customer_support, 'menu_atencion')
                 },
-                'default': self._handle_greeting
-            },
+                default=self._handle_greeting
+            ),
             
             # Menú de productos
-            'menu_productos': {
-                'options': {
-                    '1': {'handler': self._handle_productos_categorias, 'next_state': 'menu_categorias'},
-                    '2': {'handler': self._handle_promociones_generales, 'next_state': 'menu_productos'},
-                    '3': {'handler': self._handle_combos_sin_gluten, 'next_state': 'menu_productos'},
-                    '4': {'handler': self._handle_congelados_guarniciones, 'next_state': 'menu_productos'},
-                    '5': {'handler': self._handle_formas_pago, 'next_state': 'menu_productos'}
+            'menu_productos': _StateNode(
+                options={
+                    '1': _OptionEntry(self._handle_productos_categorias, 'menu_categorias'),
+                    '2': _OptionEntry(self._handle_promociones_generales, 'menu_productos'),
+                    '3': _OptionEntry(self._handle_combos_sin_gluten, 'menu_productos'),
+                    '4': _OptionEntry(self._handle_congelados_guarniciones, 'menu_productos'),
+                    '5': _OptionEntry(self._handle_formas_pago, 'menu_productos')
                 },
-                'default': self._handle_view_products,
-                'back': {'handler': self._handle_greeting, 'next_state': 'menu_principal'}
-            },
+                default=self._handle_view_products,
+                back_handler=self._handle_greeting, back_state='menu_principal'
+            ),
             
             # Menú de categorías de productos
-            'menu_categorias': {
-                'options': {
-                    '1': {'handler': self._handle_milanesas, 'next_state': 'menu_milanesas'},
-                    '2': {'handler': self._handle_congelados, 'next_state': 'menu_congelados'}
+            'menu_categorias': _StateNode(
+                options={
+                    '1': _OptionEntry(self._handle_milanesas, 'menu_milanesas'),
+                    '2': _OptionEntry(self._handle_congelados, 'menu_congelados')
                 },
-                'default': self._handle_productos_categorias,
-                'back': {'handler': self._handle_view_products, 'next_state': 'menu_productos'}
-            },
+                default=self._handle_productos_categorias,
+                back_handler=self._handle_view_products, back_state='menu_productos'
+            ),
             
             # Menú de congelados
-            'menu_congelados': {
-                'options': {
-                    '1': {'handler': self._handle_acompanamientos, 'next_state': 'menu_acompanamientos'},
-                    '2': {'handler': self._handle_tartas, 'next_state': 'menu_tartas'},
-                    '3': {'handler': self._handle_pizzas, 'next_state': 'menu_pizzas'}
+            'menu_congelados': _StateNode(
+                options={
+                    '1': _OptionEntry(self._handle_acompanamientos, 'menu_acompanamientos'),
+                    '2': _OptionEntry(self._handle_tartas, 'menu_tartas'),
+                    '3': _OptionEntry(self._handle_pizzas, 'menu_pizzas')
                 },
-                'default': self._handle_congelados,
-                'back': {'handler': self._handle_productos_categorias, 'next_state': 'menu_categorias'}
-            },
+                default=self._handle_congelados,
+                back_handler=self._handle_productos_categorias, back_state='menu_categorias'
+            ),
             
             # Estados finales para productos específicos
-            'menu_milanesas': {
-                'default': self._handle_milanesas,
-                'back': {'handler': self._handle_productos_categorias, 'next_state': 'menu_categorias'}
-            },
-            'menu_acompanamientos': {
-                'default': self._handle_acompanamientos,
-                'back': {'handler': self._handle_congelados, 'next_state': 'menu_congelados'}
-            },
-            'menu_tartas': {
-                'default': self._handle_tartas,
-                'back': {'handler': self._handle_congelados, 'next_state': 'menu_congelados'}
-            },
-            'menu_pizzas': {
-                'default': self._handle_pizzas,
-                'back': {'handler': self._handle_congelados, 'next_state': 'menu_congelados'}
-            },
+            'menu_milanesas': _StateNode(
+                default=self._handle_milanesas,
+                back_handler=self._handle_productos_categorias, back_state='menu_categorias'
+            ),
+            'menu_acompanamientos': _StateNode(
+                default=self._handle_acompanamientos,
+                back_handler=self._handle_congelados, back_state='menu_congelados'
+            ),
+            'menu_tartas': _StateNode(
+                default=self._handle_tartas,
+                back_handler=self._handle_congelados, back_state='menu_congelados'
+            ),
+            'menu_pizzas': _StateNode(
+                default=self._handle_pizzas,
+                back_handler=self._handle_congelados, back_state='menu_congelados'
+            ),
             
             # Menú de delivery
-            'menu_delivery': {
-                'options': {
-                    '1': {'handler': self._handle_consulta_zona, 'next_state': 'menu_consulta_zona'},
-                    '2': {'handler': self._handle_monto_minimo, 'next_state': 'menu_monto_minimo'},
-                    '3': {'handler': self._handle_no_estoy, 'next_state': 'menu_no_estoy'}
+            'menu_delivery': _StateNode(
+                options={
+                    '1': _OptionEntry(self._handle_consulta_zona, 'menu_consulta_zona'),
+                    '2': _OptionEntry(self._handle_monto_minimo, 'menu_monto_minimo'),
+                    '3': _OptionEntry(self._handle_no_estoy, 'menu_no_estoy')
                 },
-                'default': self._handle_make_order,
-                'back': {'handler': self._handle_greeting, 'next_state': 'menu_principal'}
-            },
+                default=self._handle_make_order,
+                back_handler=self._handle_greeting, back_state='menu_principal'
+            ),
             
             # Estados finales para opciones de delivery
-            'menu_consulta_zona': {
-                'default': self._handle_consulta_zona,
-                'back': {'handler': self._handle_make_order, 'next_state': 'menu_delivery'}
-            },
-            'menu_monto_minimo': {
-                'default': self._handle_monto_minimo,
-                'back': {'handler': self._handle_make_order, 'next_state': 'menu_delivery'}
-            },
-            'menu_no_estoy': {
-                'default': self._handle_no_estoy,
-                'back': {'handler': self._handle_make_order, 'next_state': 'menu_delivery'}
-            },
+            'menu_consulta_zona': _StateNode(
+                default=self._handle_consulta_zona,
+                back_handler=self._handle_make_order, back_state='menu_delivery'
+            ),
+            'menu_monto_minimo': _StateNode(
+                default=self._handle_monto_minimo,
+                back_handler=self._handle_make_order, back_state='menu_delivery'
+            ),
+            'menu_no_estoy': _StateNode(
+                default=self._handle_no_estoy,
+                back_handler=self._handle_make_order, back_state='menu_delivery'
+            ),
             
             # Otros menús
-            'menu_manipulacion': {
-                'default': self._handle_manipulacion,
-                'back': {'handler': self._handle_greeting, 'next_state': 'menu_principal'}
-            },
-            'menu_recetas': {
-                'default': self._handle_recetas,
-                'back': {'handler': self._handle_greeting, 'next_state': 'menu_principal'}
-            },
-            'menu_atencion': {
-                'default': self._handle_customer_support,
-                'back': {'handler': self._handle_greeting, 'next_state': 'menu_principal'}
-            }
+            'menu_manipulacion': _StateNode(
+                default=self._handle_manipulacion,
+                back_handler=self._handle_greeting, back_state='menu_principal'
+            ),
+            'menu_recetas': _StateNode(
+                default=self._handle_recetas,
+                back_handler=self._handle_greeting, back_state='menu_principal'
+            ),
+            'menu_atencion': _StateNode(
+                default=self._handle_customer_support,
+                back_handler=self._handle_greeting, back_state='menu_principal'
+            )
         }
         
-        # Mapeo de intenciones a funciones de manejo
-        self.intent_handlers = {
-            'saludo': self._handle_greeting,
-            'ver_productos': self._handle_view_products,
-            'hacer_pedido': self._handle_make_order,
-            'consultar_estado': self._handle_order_status,
-            'ofertas_especiales': self._handle_special_offers,
-            'atencion_cliente': self._handle_customer_support,
+        # Tabla plana derivada de state_handlers: estado -> manejador por defecto
+        self._defaults: Dict[str, Callable] = {
+            state: node.default
+            for state, node in self.state_handlers.items()
+            if node.default is not None
         }
     
     def process_message(self, from_number: str, message: str, 
@@ -197,91 +322,137 @@ class ChatbotHandler(BaseConversationHandler):
             Texto de respuesta para enviar al usuario, o None si el manejador
             no puede procesar este mensaje
         """
+        with self._state_ctx(from_number):
+            return self._process_message(from_number, message, intent, confidence)
+    
+    @contextlib.contextmanager
+    def _state_ctx(self, from_number: str):
+        """
+        Mantiene el estado del usuario en un contexto por hilo mientras dura el bloque.
+        
+        El estado se lee de la caché como mucho una vez y se escribe una sola vez al
+        final, solo si se actualizó (y no quedó igual a uno escrito hace poco).
+        """
+        outer_ctx = getattr(self._local, 'ctx', None)
+        ctx = _StateCtx(from_number)
+        self._local.ctx = ctx
+        try:
+            yield ctx
+        finally:
+            self._local.ctx = outer_ctx
+            # Un solo registro INFO por mensaje, con los datos en `extra`
+            # para los formateadores estructurados; el detalle queda en DEBUG
+            logger.info("Mensaje de %s procesado: estado %s -> %s %s",
+                        from_number, ctx.loaded, ctx.state, ctx.events,
+                        extra={'from_number': from_number, 'state_before': ctx.loaded,
+                               'state_after': ctx.state, **ctx.events})
+            if ctx.dirty and not (ctx.state == ctx.loaded and self._recently_written(from_number, ctx.state)):
+                self._write_user_state(from_number, ctx.state)
+    
+    def _process_message(self, from_number: str, message: str,
+                         intent: Optional[str], confidence: Optional[float]) -> Optional[str]:
+        """Cuerpo de process_message, con el estado del usuario ya en contexto"""
         try:
-            # Limpiar el mensaje
-            message_clean = message.strip().lower()
+            # Limpiar el mensaje: sin acentos y en minúsculas, con una sola pasada de
+            # str.translate (una opción de un dígito no necesita normalizarse)
+            message_clean = message.strip()
+            is_option = message_clean in _NUMERIC_OPTIONS
+            if not is_option:
+                message_clean = normalize(message_clean)
+                is_option = message_clean.isdigit()
+            
+            # Las intenciones explícitas con respuesta fija no dependen del estado: se
+            # responden antes de leerlo ("volver" y las opciones numéricas tienen prioridad)
+            if not is_option and message_clean not in COMANDOS_VOLVER:
+                intent_response = self._constant_intent_response(from_number, intent, confidence)
+                if intent_response:
+                    return intent_response
             
             # Obtener el estado actual del usuario
             current_state = self._get_user_state(from_number)
-            logger.info(f"ChatbotHandler procesando mensaje '{message_clean}' en estado '{current_state}'")
+            logger.debug("ChatbotHandler procesando mensaje '%s' en estado '%s'", message_clean, current_state)
             
-            # DEBUG: Registrar el estado actual y el mensaje para diagnóstico
-            logger.info(f"DEBUG - Estado actual: {current_state} | Mensaje: '{message_clean}'")
-            if hasattr(self, "_user_states"):
-                logger.info(f"DEBUG - Estados de usuario: {self._user_states}")
+            # DEBUG: Registrar los estados de usuario para diagnóstico. El volcado crece
+            # con la cantidad de usuarios, así que solo se arma si DEBUG está activo
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("DEBUG - Estado actual: %s | Mensaje: '%s'", current_state, message_clean)
+                logger.debug("DEBUG - Estados de usuario: %s", self._user_states)
             
             # Si no hay estado actual, establecer el estado inicial
             if not current_state:
                 current_state = 'initial'
                 self._set_user_state(from_number, current_state)
-                logger.info(f"Estado inicial establecido: {current_state}")
+                logger.debug("Estado inicial establecido: %s", current_state)
             
             # 1. Comando "volver" (prioridad máxima para navegación)
-            if message_clean == "volver":
-                logger.info(f"Procesando comando 'volver' desde estado {current_state}")
+            if message_clean in COMANDOS_VOLVER:
+                self._note(action='volver')
                 return self._handle_back_navigation(from_number, current_state)
             
             # 2. Opciones numéricas en el contexto del estado actual (prioridad alta)
-            if message_clean.isdigit():
-                logger.info(f"Procesando opción numérica '{message_clean}' en estado '{current_state}'")
-                
-                # IMPORTANTE: Validar explícitamente que estamos en un estado válido
-                if current_state not in self.state_handlers:
-                    logger.error(f"Estado actual '{current_state}' no encontrado en state_handlers")
-                    # Restablecer al menú principal si el estado es inválido
-                    self._set_user_state(from_number, 'menu_principal')
-                    return MENSAJE_MENU_PRINCIPAL
+            if is_option:
+                self._note(action='opcion', option=message_clean)
                 
                 # Manejar la opción ESTRICTAMENTE en el contexto del estado actual
+                # (_handle_state_option valida el estado y lo restablece si es inválido)
                 option_response = self._handle_state_option(from_number, current_state, message_clean)
                 
                 # Siempre devolver la respuesta para opciones numéricas
                 # Esto evita que las opciones numéricas se procesen como otros tipos de mensajes
                 return option_response
             
-            # 3. Intenciones explícitas con confianza alta
-            if intent and intent != "desconocido" and confidence and confidence > 0.65:
-                handler = self.intent_handlers.get(intent)
-                if handler:
-                    logger.info(f"Manejando intención explícita '{intent}' con confianza {confidence}")
-                    
-                    # Actualizar el estado según la intención
-                    if intent == 'saludo':
-                        self._set_user_state(from_number, 'menu_principal')
-                    elif intent == 'ver_productos':
-                        self._set_user_state(from_number, 'menu_productos')
-                    elif intent == 'hacer_pedido':
-                        self._set_user_state(from_number, 'menu_delivery')
-                    
-                    response = handler(from_number, message)
-                    return response
+            # 3. Las intenciones explícitas ya se resolvieron al principio
             
             # 4. Respuesta por defecto para el estado actual
-            state_config = self.state_handlers.get(current_state)
-            if state_config and 'default' in state_config:
-                default_handler = state_config['default']
-                logger.info(f"Usando manejador por defecto para estado '{current_state}'")
+            default_handler = self._defaults.get(current_state)
+            if default_handler:
+                self._note(action='default')
                 return default_handler(from_number, message)
             
             # 5. Intentar usar el manejador por defecto del estado padre si existe
             # SOLO para mensajes de texto, NO para opciones numéricas (ya manejadas arriba)
-            menu_hierarchy = self._get_menu_hierarchy()
-            if current_state in menu_hierarchy and menu_hierarchy[current_state].get("parent"):
-                parent_state = menu_hierarchy[current_state]["parent"]
-                parent_config = self.state_handlers.get(parent_state)
-                if parent_config and 'default' in parent_config:
-                    logger.info(f"Usando manejador por defecto del estado padre '{parent_state}'")
-                    return parent_config['default'](from_number, message)
+            parent_state = self._PARENT_OF.get(current_state)
+            if parent_state:
+                parent_handler = self._defaults.get(parent_state)
+                if parent_handler:
+                    self._note(action='default_padre', parent_state=parent_state)
+                    return parent_handler(from_number, message)
             
             # Si llegamos aquí, no pudimos manejar el mensaje
-            logger.info(f"No se pudo manejar el mensaje '{message_clean}' en estado '{current_state}', delegando al AI")
+            self._note(action='delegado_ai')
+            return None
+            
+        except Exception:
+            # logger.exception incluye el mensaje del error y la traza
+            logger.exception("Error en el manejador de chatbot")
             return None
+    
+    def _constant_intent_response(self, from_number: str, intent: Optional[str],
+                                  confidence: Optional[float]) -> Optional[str]:
+        """
+        Responde una intención explícita con confianza alta desde INTENT_RESPONSES.
+        
+        Args:
+            from_number: Número de teléfono del usuario
+            intent: Intención detectada ('desconocido' no está en la tabla)
+            confidence: Confianza de la detección
             
-        except Exception as e:
-            logger.error(f"Error en el manejador de chatbot: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
+        Returns:
+            El mensaje fijo de la intención, o None si no aplica
+        """
+        if not (intent and confidence and confidence > 0.65):
+            return None
+        intent_response = self.INTENT_RESPONSES.get(intent)
+        if not intent_response:
             return None
+        
+        self._note(action='intencion', intent=intent, confidence=confidence)
+        
+        # Actualizar el estado según la intención
+        next_state, response = intent_response
+        if next_state:
+            self._set_user_state(from_number, next_state)
+        return response
     
     def _handle_state_option(self, from_number: str, current_state: str, option: str) -> Optional[str]:
         """
@@ -295,74 +466,48 @@ class ChatbotHandler(BaseConversationHandler):
         Returns:
             Respuesta para el usuario o None si no se puede manejar
         """
-        logger.info(f"Procesando opción {option} en estado {current_state}")
-        
         # DEBUG: Registrar información detallada para diagnóstico
-        logger.info(f"DEBUG - _handle_state_option: Estado={current_state}, Opción={option}")
+        logger.debug("DEBUG - _handle_state_option: Estado=%s, Opción=%s", current_state, option)
         
         # Validación explícita del estado actual
-        if current_state not in self.state_handlers:
-            logger.error(f"Estado '{current_state}' no encontrado en state_handlers")
+        node = self.state_handlers.get(current_state)
+        if node is None:
+            logger.error("Estado '%s' no encontrado en state_handlers", current_state)
             # Restablecer al menú principal si el estado es inválido
             self._set_user_state(from_number, 'menu_principal')
             return MENSAJE_MENU_PRINCIPAL
         
-        # Obtener la configuración del estado actual
-        state_config = self.state_handlers.get(current_state)
-        logger.info(f"DEBUG - Configuración del estado: {state_config}")
-        
-        # Si hay configuración para el estado actual y tiene opciones definidas
-        if state_config and 'options' in state_config:
-            # DEBUG: Registrar todas las opciones disponibles en este estado
-            logger.info(f"DEBUG - Opciones disponibles en {current_state}: {list(state_config['options'].keys())}")
-            
-            # Verificar si la opción existe en este estado
-            if option in state_config['options']:
-                option_config = state_config['options'][option]
-                handler = option_config.get('handler')
-                next_state = option_config.get('next_state')
-                
-                logger.info(f"DEBUG - Opción {option} encontrada en estado {current_state}")
-                logger.info(f"DEBUG - Handler: {handler.__name__ if handler else None}, Next state: {next_state}")
-                
-                # Actualizar el estado si es necesario
-                if next_state:
-                    # Guardar el estado anterior antes de actualizarlo
-                    previous_state = current_state
-                    self._set_user_state(from_number, next_state)
-                    logger.info(f"Transición de estado: {previous_state} -> {next_state}")
-                
-                # Ejecutar el manejador si existe
-                if handler:
-                    logger.info(f"Ejecutando manejador para opción {option} en estado {current_state}")
-                    return handler(from_number, option)
-                
-                # Si no hay handler pero hay next_state, usar el default del nuevo estado
-                if next_state and not handler:
-                    new_state_config = self.state_handlers.get(next_state)
-                    if new_state_config and 'default' in new_state_config:
-                        logger.info(f"Usando manejador por defecto del nuevo estado {next_state}")
-                        return new_state_config['default'](from_number, option)
-                
-                # Si llegamos aquí, la opción existe pero no tiene handler ni next_state
-                # Devolver un mensaje genérico para evitar que se pase al fallback
-                return f"Opción {option} seleccionada en {current_state}"
-            else:
-                logger.warning(f"Opción {option} no encontrada en estado {current_state}")
+        # Buscar la opción en el estado actual: las de un dígito, en la tabla de salto
+        if len(option) == 1 and '0' <= option <= '9':
+            entry = node.options_arr[ord(option) - 48]
         else:
-            logger.warning(f"No hay opciones definidas para el estado {current_state}")
+            entry = node.options.get(option)
+        if entry:
+            handler, next_state = entry.handler, entry.next_state
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("DEBUG - Handler: %s, Next state: %s", handler.__name__, next_state)
+            
+            # Actualizar el estado si es necesario
+            if next_state:
+                self._set_user_state(from_number, next_state)
+                logger.debug("Transición de estado: %s -> %s", current_state, next_state)
+            
+            logger.debug("Ejecutando manejador para opción %s en estado %s", option, current_state)
+            return handler(from_number, option)
         
-        # Si no hay opciones definidas para este estado o la opción no está en ellas,
-        # verificar si hay un manejador por defecto para este estado específico
-        if state_config and 'default' in state_config:
-            logger.info(f"Usando manejador por defecto para estado '{current_state}' con opción no reconocida '{option}'")
-            return state_config['default'](from_number, option)
+        logger.warning("Opción %s no encontrada en estado %s", option, current_state)
+        
+        # Si la opción no está definida para este estado, verificar si hay un
+        # manejador por defecto para este estado específico
+        if node.default:
+            logger.debug("Usando manejador por defecto para estado '%s' con opción no reconocida '%s'", current_state, option)
+            return node.default(from_number, option)
         
         # IMPORTANTE: NO buscar en menús padre para mantener el contexto estricto
-        logger.info(f"Búsqueda en menús padre desactivada para mantener contexto estricto del menú")
+        logger.debug("Búsqueda en menús padre desactivada para mantener contexto estricto del menú")
         
         # Devolver un mensaje informativo claro para el usuario
-        return f"La opción {option} no está disponible en este menú. Por favor, selecciona una opción válida."
+        return _invalid_option_message(option)
 
     
     def _get_menu_hierarchy(self):
@@ -370,43 +515,9 @@ class ChatbotHandler(BaseConversationHandler):
         Devuelve la jerarquía de navegación del menú.
         
         Returns:
-            Diccionario con la jerarquía de menús
+            Diccionario (de solo lectura) con la jerarquía de menús
         """
-        return {
-            # Nivel 1: Menú principal y sus opciones directas
-            "menu_principal": {
-                "parent": None,  # No tiene padre, es el nivel superior
-                "message": MENSAJE_MENU_PRINCIPAL
-            },
-            
-            # Nivel 2: Submenús principales que dependen del menú principal
-            "menu_productos": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Ver productos
-            "menu_delivery": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Hacer pedido
-            "menu_manipulacion": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Manipulación
-            "menu_recetas": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Recetas
-            "menu_atencion": {"parent": "menu_principal", "message": MENSAJE_MENU_PRINCIPAL},  # Atención al cliente
-            
-            # Nivel 3: Opciones del menú de productos
-            "menu_categorias": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Categorías
-            "menu_promociones_generales": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Promociones
-            "menu_combos_sin_gluten": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Combos
-            "menu_congelados_guarniciones": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Congelados
-            "menu_formas_pago": {"parent": "menu_productos", "message": MENSAJE_VER_PRODUCTOS},  # Formas de pago
-            
-            # Nivel 4: Categorías de productos
-            "menu_milanesas": {"parent": "menu_categorias", "message": MENSAJE_PRODUCTOS_POR_CATEGORIAS},  # Milanesas
-            "menu_congelados": {"parent": "menu_categorias", "message": MENSAJE_PRODUCTOS_POR_CATEGORIAS},  # Congelados
-            
-            # Nivel 5: Opciones de congelados
-            "menu_acompanamientos": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Acompañamientos
-            "menu_tartas": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Tartas individuales
-            "menu_pizzas": {"parent": "menu_congelados", "message": MENSAJE_CONGELADOS},  # Pizzas masa madre
-            
-            # Nivel 3: Opciones del menú de delivery
-            "menu_consulta_zona": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # Consultar zona
-            "menu_monto_minimo": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # Monto mínimo
-            "menu_no_estoy": {"parent": "menu_delivery", "message": MENSAJE_HACER_PEDIDO},  # No estoy en CABA
-        }
+        return self.MENU_HIERARCHY
         
     def _handle_back_navigation(self, from_number: str, current_state: str) -> str:
         """
@@ -419,23 +530,20 @@ class ChatbotHandler(BaseConversationHandler):
         Returns:
             Respuesta para el usuario
         """
-        # Obtener la jerarquía de navegación del menú
-        menu_hierarchy = self._get_menu_hierarchy()
-        
         # Si el estado actual está en la jerarquía y tiene un padre, navegar a él
-        if current_state in menu_hierarchy and menu_hierarchy[current_state].get("parent") is not None:
-            parent_state = menu_hierarchy[current_state]["parent"]
-            parent_message = menu_hierarchy[parent_state]["message"]
+        parent_state = self._PARENT_OF.get(current_state)
+        if parent_state:
+            parent_message = self.MENU_HIERARCHY[parent_state]["message"]
             
             # Actualizar el estado del usuario
             self._set_user_state(from_number, parent_state)
-            logger.info(f"Navegación hacia atrás: {current_state} -> {parent_state}")
+            logger.debug("Navegación hacia atrás: %s -> %s", current_state, parent_state)
             
             # Devolver el mensaje correspondiente al estado padre
             return parent_message
         
         # Si el estado no está en la jerarquía o no tiene padre, volver al menú principal
-        logger.info(f"Navegación hacia menú principal desde: {current_state}")
+        logger.debug("Navegación hacia menú principal desde: %s", current_state)
         self._set_user_state(from_number, "menu_principal")
         return MENSAJE_MENU_PRINCIPAL
     
@@ -464,36 +572,75 @@ class ChatbotHandler(BaseConversationHandler):
         self._set_user_state(from_number, "menu_formas_pago")
         return MENSAJE_FORMAS_PAGO
     
+    def _request_ctx(self, from_number: str) -> Optional[_StateCtx]:
+        """Contexto del mensaje en curso si corresponde a este usuario"""
+        ctx = getattr(self._local, 'ctx', None)
+        if ctx is not None and ctx.from_number == from_number:
+            return ctx
+        return None
+    
+    def _note(self, **events) -> None:
+        """Anota datos del mensaje en curso para el registro que se emite al terminar"""
+        ctx = getattr(self._local, 'ctx', None)
+        if ctx is not None:
+            ctx.events.update(events)
+    
     def _get_user_state(self, from_number: str) -> str:
         """Obtiene el estado actual del usuario de forma persistente usando cache"""
-        # Usar un prefijo para evitar colisiones con otras claves de cache
-        cache_key = f"whatsapp_user_state:{from_number}"
-        state = cache.get(cache_key)
+        ctx = self._request_ctx(from_number)
+        if ctx is not None and ctx.state is not None:
+            return ctx.state
+        
+        # Primero la copia en memoria; si no está o expiró, la caché de Django
+        with _l1_lock:
+            state = _l1_states.get(from_number)
+        if state is None:
+            # Usar un prefijo para evitar colisiones con otras claves de cache
+            cache_key = f"whatsapp_user_state:{from_number}"
+            state = cache.get(cache_key)
+            if state is not None:
+                with _l1_lock:
+                    _l1_states[from_number] = state
         
         # Si no hay estado en cache, usar el valor por defecto
         if state is None:
             state = "menu_principal"
             # Guardar el estado por defecto en cache
             self._set_user_state(from_number, state)
+        elif ctx is not None:
+            ctx.state = ctx.loaded = state
         
-        logger.info(f"_get_user_state: Recuperado estado '{state}' para usuario {from_number}")
+        # Se consulta varias veces por mensaje: solo en DEBUG
+        logger.debug("_get_user_state: Recuperado estado '%s' para usuario %s", state, from_number)
         return state
     
     def _set_user_state(self, from_number: str, state: str) -> None:
         """Establece el estado del usuario de forma persistente usando cache"""
+        logger.debug("Estado del usuario %s actualizado a: %s", from_number, state)
+        
+        # Durante un mensaje solo se actualiza el contexto; process_message lo escribe al final
+        ctx = self._request_ctx(from_number)
+        if ctx is not None:
+            ctx.state = state
+            ctx.dirty = True
+            return
+        self._write_user_state(from_number, state)
+    
+    def _write_user_state(self, from_number: str, state: str) -> None:
         # Usar un prefijo para evitar colisiones con otras claves de cache
         cache_key = f"whatsapp_user_state:{from_number}"
         
         # Guardar en cache con un tiempo de expiración de 24 horas (86400 segundos)
         # Esto evita acumular estados de usuarios que ya no interactúan con el bot
         cache.set(cache_key, state, timeout=86400)
-        
-        logger.info(f"Estado del usuario {from_number} actualizado a: {state}")
-        
-        # También mantener una copia en memoria para debugging
-        if not hasattr(self, "_user_states"):
-            self._user_states = {}
-        self._user_states[from_number] = state
+        with _l1_lock:
+            _l1_states[from_number] = state
+            _recent_writes[from_number] = state
+    
+    def _recently_written(self, from_number: str, state: str) -> bool:
+        """Indica si este proceso escribió ese mismo estado en la última hora"""
+        with _l1_lock:
+            return _recent_writes.get(from_number) == state
     
     # Manejadores de intenciones
     def _handle_greeting(self, from_number: str, message: str) -> str:
@@ -527,7 +674,7 @@ class ChatbotHandler(BaseConversationHandler):
     def _handle_back_command(self, from_number: str) -> str:
         """Maneja el comando 'volver'"""
         current_state = self._get_user_state(from_number)
-        logger.info(f"Manejando comando 'volver' en estado '{current_state}'")
+        logger.info("Manejando comando 'volver' en estado '%s'", current_state)
         
         # Usar el método _handle_back_navigation para manejar la navegación hacia atrás
         return self._handle_back_navigation(from_number, current_state)
@@ -580,3 +727,17 @@ class ChatbotHandler(BaseConversationHandler):
         return MENSAJE_RECETAS
         
     # Eliminamos el método _handle_non_menu_message ya que delegaremos al AI Assistant
+
+
+@functools.lru_cache(maxsize=1)
+def get_chatbot_handler() -> ChatbotHandler:
+    """
+    Devuelve una instancia de ChatbotHandler compartida por todo el proceso.
+    
+    La instancia no guarda estado de usuarios (vive en la caché de Django y, durante
+    un mensaje, en un contexto por hilo), así que puede usarse desde varios hilos.
+    
+    Returns:
+        La instancia compartida de ChatbotHandler
+    """
+    return ChatbotHandler()
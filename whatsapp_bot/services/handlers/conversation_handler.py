@@ -4,24 +4,161 @@ Manejador de Conversación
 Este módulo proporciona la clase ConversationHandler que gestiona el flujo de conversación
 para el bot de WhatsApp, incluyendo la detección de intenciones y el enrutamiento de mensajes.
 """
+import functools
 import logging
 import re
-import traceback
+import sys
 from typing import Dict, Any, List, Optional, Tuple
 from django.conf import settings
 from ..constants import (
-    PALABRAS_SALUDO, PALABRAS_VER_PRODUCTOS, PALABRAS_HACER_PEDIDO,
-    PALABRAS_ESTADO_PEDIDO, PALABRAS_OFERTAS_ESPECIALES, PALABRAS_ATENCION_CLIENTE,
-    MENSAJE_BIENVENIDA, MENSAJE_NO_ENTIENDO, MENSAJE_ERROR,
+    PALABRAS_POR_INTENCION, MENSAJE_BIENVENIDA, MENSAJE_NO_ENTIENDO, MENSAJE_ERROR,
     INTENT_ALTA_CONFIANZA, INTENT_MEDIA_CONFIANZA, INTENT_BAJA_CONFIANZA,
-    INTENCIONES_PREDETERMINADAS
+    INTENCIONES_PREDETERMINADAS, INTENCION_DESCONOCIDA, COMANDOS_VOLVER
 )
+from ...utils.text import normalize
 from .base_handler import BaseConversationHandler
-from .chatbot_handler import ChatbotHandler
+from .chatbot_handler import get_chatbot_handler
 from .twilio_ai_handler import TwilioAIHandler
 
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick es opcional; sin él se usan regex precompiladas
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+
+def _keyword_pattern(keywords: List[str]) -> str:
+    """Patrón regex que reconoce cualquiera de las palabras clave como palabra completa"""
+    escaped_keywords = [re.escape(kw) for kw in keywords]
+    # Grupo sin captura: solo se cuentan las coincidencias, no se extraen
+    return r'\b(?:' + '|'.join(escaped_keywords) + r')\b'
+
+
+# Pares (intención, regex), compiladas una sola vez y en el orden de
+# PALABRAS_POR_INTENCION (fallback cuando no hay pyahocorasick)
+_INTENT_REGEXES: Tuple[Tuple[str, re.Pattern], ...] = tuple(
+    (intent, re.compile(_keyword_pattern(keywords)))
+    for intent, keywords in PALABRAS_POR_INTENCION.items()
+)
+
+# Todas las palabras clave en un solo patrón: si no encuentra nada, ninguna de las
+# regex por intención lo haría, y el mensaje se descarta con una sola búsqueda
+_ANY_INTENT_REGEX = re.compile(_keyword_pattern(
+    list(dict.fromkeys(kw for keywords in PALABRAS_POR_INTENCION.values() for kw in keywords))
+))
+
+
+# Confianza máxima que puede alcanzar una intención detectada por palabras clave
+MAX_INTENT_CONFIDENCE = 0.9
+
+
+# Indicadores de que el mensaje es una pregunta (se buscan como subcadenas)
+QUESTION_INDICATORS = (
+    '?', 'cómo', 'como', 'qué', 'que', 'cuál', 'cual', 'cuándo', 'cuando',
+    'dónde', 'donde', 'por qué', 'por que', 'quién', 'quien', 'cuánto', 'cuanto',
+    'explica', 'puedes', 'podrías', 'podrias', 'dime',
+)
+# Todos los indicadores en una alternancia: una búsqueda en lugar de una por indicador
+_QUESTION_RE = re.compile('|'.join(re.escape(indicator) for indicator in QUESTION_INDICATORS))
+
+
+# Zonas de ejemplo donde se entrega (se buscan como subcadenas del mensaje en minúsculas)
+ZONAS_DISPONIBLES = (
+    'palermo', 'recoleta', 'belgrano', 'nuñez', 'caballito', 'flores',
+    'villa urquiza', 'villa crespo', 'almagro', 'boedo', 'san telmo',
+    'puerto madero', 'retiro', 'colegiales', 'villa devoto',
+)
+_ZONAS_RE = re.compile('|'.join(re.escape(zona) for zona in ZONAS_DISPONIBLES))
+
+
+def _build_intent_automaton():
+    """
+    Construye un autómata Aho-Corasick con todas las palabras clave de intención.
+    
+    Cada palabra clave guarda la lista de (intención, prioridad, longitud) a la que
+    pertenece; la prioridad es su posición en la lista original, que es el orden en
+    que la alternancia del regex las probaría.
+    """
+    if ahocorasick is None:
+        return None
+    
+    entries = {}
+    for intent, keywords in PALABRAS_POR_INTENCION.items():
+        for priority, keyword in enumerate(keywords):
+            entries.setdefault(keyword, []).append((intent, priority, len(keyword)))
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, values in entries.items():
+        automaton.add_word(keyword, tuple(values))
+    automaton.make_automaton()
+    return automaton
+
+
+INTENT_AUTOMATON = _build_intent_automaton()
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _clean_message(message: str) -> Tuple[str, str]:
+    """
+    Limpia el mensaje una sola vez para todo el procesamiento.
+
+    Returns:
+        Tupla de (mensaje sin espacios en los extremos y en minúsculas, con acentos
+        para las preguntas y zonas; el mismo sin acentos, para las palabras clave)
+    """
+    message_clean = message.strip().lower()
+    return message_clean, normalize(message_clean)
+
+
+def _count_intent_matches(message: str) -> Dict[str, int]:
+    """
+    Cuenta, por intención, las coincidencias de palabras clave en el mensaje.
+    
+    Con pyahocorasick recorre el mensaje una sola vez para todas las intenciones y
+    reproduce el conteo de coincidencias del patrón `\\b(?:kw1|kw2|...)\\b`:
+    solo palabras completas, sin solapamientos y, para un mismo inicio, la palabra
+    clave que aparece primero en la lista.
+    """
+    if INTENT_AUTOMATON is None:
+        if not _ANY_INTENT_REGEX.search(message):
+            return {}
+        counts = {}
+        for intent, regex in _INTENT_REGEXES:
+            match_count = sum(1 for _ in regex.finditer(message))
+            if match_count:
+                counts[intent] = match_count
+        return counts
+    
+    spans = {}
+    length = len(message)
+    for last_index, values in INTENT_AUTOMATON.iter(message):
+        end = last_index + 1
+        if end < length and _is_word_char(message[end]):
+            continue
+        for intent, priority, keyword_length in values:
+            start = end - keyword_length
+            if start > 0 and _is_word_char(message[start - 1]):
+                continue
+            spans.setdefault(intent, []).append((start, priority, end))
+    
+    counts = {}
+    for intent in PALABRAS_POR_INTENCION:
+        if intent not in spans:
+            continue
+        match_count = 0
+        position = 0
+        for start, _, end in sorted(spans[intent]):
+            if start >= position:
+                match_count += 1
+                position = end
+        counts[intent] = match_count
+    return counts
+
+
 class ConversationHandler(BaseConversationHandler):
     """
     Manejador principal de conversación que gestiona el flujo de mensajes.
@@ -34,7 +171,8 @@ class ConversationHandler(BaseConversationHandler):
         super().__init__()
         
         # Inicializar los sub-manejadores
-        self.chatbot_handler = ChatbotHandler()
+        # ChatbotHandler no guarda estado de usuarios: una sola instancia por proceso
+        self.chatbot_handler = get_chatbot_handler()
         self.twilio_ai_handler = TwilioAIHandler()
         
         # Umbral de confianza para determinar cuándo usar el asistente AI
@@ -42,60 +180,65 @@ class ConversationHandler(BaseConversationHandler):
         
         logger.info("ConversationHandler inicializado con sistema de estados mejorado")
     
-    def detect_intent(self, message: str) -> Tuple[str, float]:
+    def detect_intent(self, message: str, normalized: Optional[str] = None) -> Tuple[str, float]:
         """
         Detecta la intención del mensaje utilizando coincidencia de patrones simple.
         
         Args:
             message: El mensaje del usuario
+            normalized: El mensaje ya normalizado por _clean_message (opcional)
             
         Returns:
             Tupla de (intención, confianza)
         """
-        # Limpiar el mensaje
-        message = message.strip().lower()
-        
-        # Coincidencia de patrones simple para intenciones
-        patterns = {
-            'saludo': self._create_pattern(PALABRAS_SALUDO),
-            'ver_productos': self._create_pattern(PALABRAS_VER_PRODUCTOS),
-            'hacer_pedido': self._create_pattern(PALABRAS_HACER_PEDIDO),
-            'consultar_estado': self._create_pattern(PALABRAS_ESTADO_PEDIDO),
-            'ofertas_especiales': self._create_pattern(PALABRAS_OFERTAS_ESPECIALES),
-            'atencion_cliente': self._create_pattern(PALABRAS_ATENCION_CLIENTE),
-        }
+        # Limpiar el mensaje (minúsculas y sin acentos, como las palabras clave). Los
+        # mensajes cortos se repiten mucho ("hola", "menu"...): se memoriza el resultado
+        # por mensaje normalizado
+        if normalized is None:
+            _, normalized = _clean_message(message)
+        return self._detect_intent_normalized(normalized)
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _detect_intent_normalized(message: str) -> Tuple[str, float]:
+        """Cuerpo de detect_intent, para un mensaje ya normalizado"""
+        # Las opciones numéricas de menú ("1".."5") no contienen palabras clave y
+        # su significado depende del estado, que resuelve el ChatbotHandler
+        if message.isdigit():
+            return INTENCION_DESCONOCIDA, 0.1
+
+        # Una sola pasada sobre el mensaje para todas las intenciones
+        match_counts = _count_intent_matches(message)
         
-        # Verificar cada patrón
-        matched_intents = []
-        for intent, pattern in patterns.items():
-            # Comprobar si hay coincidencia
-            match = re.search(pattern, message)
-            if match:
+        # Verificar cada intención en el orden de PALABRAS_POR_INTENCION, quedándose con
+        # la de mayor confianza (ante empates, la primera). Por defecto, baja confianza
+        # si no hay coincidencias
+        best_intent, best_confidence = INTENCION_DESCONOCIDA, 0.1
+        for intent, match_count in match_counts.items():
+            if match_count:
                 # Puntuación de confianza simple basada en el recuento de coincidencias de palabras
-                matches = re.findall(pattern, message)
-                confidence = min(0.9, len(matches) * 0.3)  # Limitar a 0.9
+                confidence = min(MAX_INTENT_CONFIDENCE, match_count * 0.3)  # Limitar a 0.9
                 
                 # Para saludos, ajustar la confianza basada en la longitud del mensaje
                 # Si el mensaje es más largo, probablemente no es un simple saludo
                 if intent == 'saludo':
-                    # Reducir la confianza para mensajes largos que contienen saludos
-                    words = message.split()
-                    if len(words) > 5:  # Si el mensaje tiene más de 5 palabras
+                    # Reducir la confianza para mensajes largos que contienen saludos.
+                    # Basta con contar hasta 6 palabras: maxsplit evita partir el resto
+                    word_count = len(message.split(maxsplit=5))
+                    if word_count > 5:  # Si el mensaje tiene más de 5 palabras
                         confidence = min(confidence, 0.5)  # Reducir confianza
-                    elif len(words) <= 2:  # Si es un saludo corto (1-2 palabras)
+                    elif word_count <= 2:  # Si es un saludo corto (1-2 palabras)
                         confidence = max(confidence, 0.7)  # Mantener confianza alta
                     else:  # Para mensajes de longitud media
                         confidence = min(confidence, 0.6)  # Confianza moderada
                 
-                matched_intents.append((intent, confidence))
+                if confidence > best_confidence:
+                    best_intent, best_confidence = intent, confidence
+                    # Ninguna intención posterior puede superar el máximo
+                    if best_confidence >= MAX_INTENT_CONFIDENCE:
+                        break
         
-        # Si encontramos múltiples intenciones, elegir la de mayor confianza
-        if matched_intents:
-            matched_intents.sort(key=lambda x: x[1], reverse=True)
-            return matched_intents[0]
-        
-        # Por defecto, baja confianza si no hay coincidencias
-        return "desconocido", 0.1
+        return best_intent, best_confidence
     
     def _create_pattern(self, keywords: List[str]) -> str:
         """
@@ -107,8 +250,7 @@ class ConversationHandler(BaseConversationHandler):
         Returns:
             Patrón regex como string
         """
-        escaped_keywords = [re.escape(kw) for kw in keywords]
-        return r'\b(' + '|'.join(escaped_keywords) + r')\b'
+        return _keyword_pattern(keywords)
     
     def process_message(self, from_number: str, message: str, 
                         intent: Optional[str] = None, 
@@ -127,8 +269,8 @@ class ConversationHandler(BaseConversationHandler):
         """
         try:
             # Limpiar el mensaje y registrar entrada
-            message_clean = message.strip().lower()
-            logger.info(f"ConversationHandler.process_message llamado con mensaje: '{message_clean}' de {from_number}")
+            message_clean, message_normalized = _clean_message(message)
+            logger.info("ConversationHandler.process_message llamado con mensaje: '%s' de %s", message_clean, from_number)
             
             # Inicializar el estado del usuario si es necesario (asegurar que tenga un estado)
             if not hasattr(self.chatbot_handler, '_user_states'):
@@ -137,50 +279,47 @@ class ConversationHandler(BaseConversationHandler):
             
             # Obtener el estado actual del usuario para contexto
             current_state = self.chatbot_handler._get_user_state(from_number)
-            logger.info(f"Estado actual del usuario {from_number}: {current_state}")
-            
-            # Detectar la intención del mensaje si no se proporcionó
-            if intent is None or confidence is None:
-                intent, confidence = self.detect_intent(message)
-                logger.info(f"Intención detectada: {intent}, confianza: {confidence}")
+            logger.info("Estado actual del usuario %s: %s", from_number, current_state)
             
             # Estrategia mejorada de procesamiento:
             
-            # 1. Manejar comandos de navegación explícitos primero
-            if message_clean == "volver":
-                logger.info(f"Procesando comando de navegación 'volver' en estado '{current_state}'")
-                chatbot_response = self.chatbot_handler.process_message(from_number, message_clean)
-                logger.info(f"Respuesta del chatbot para 'volver': {chatbot_response}")
-                if chatbot_response:
-                    return chatbot_response
+            # El chatbot se consulta una sola vez por mensaje: para navegación y opciones
+            # numéricas (pasos 1-2) o, si no, con la intención explícita o sin ella (5-6).
+            # Si no responde, una segunda llamada con el mismo mensaje y estado tampoco lo haría
+            is_navigation = message_clean in COMANDOS_VOLVER or message_clean.isdigit()
             
-            # 2. Manejar opciones numéricas de menú - Prioridad alta para pruebas
-            if message_clean.isdigit():
-                logger.info(f"Procesando opción de menú: '{message_clean}' en estado '{current_state}'")
+            # 1-2. Comandos de navegación ("volver") y opciones numéricas de menú
+            if is_navigation:
+                logger.info("Procesando comando de navegación u opción de menú '%s' en estado '%s'", message_clean, current_state)
                 chatbot_response = self.chatbot_handler.process_message(from_number, message_clean)
-                logger.info(f"Respuesta del chatbot para opción numérica '{message_clean}': {chatbot_response}")
+                logger.info("Respuesta del chatbot para '%s': %s", message_clean, chatbot_response)
                 if chatbot_response:
                     return chatbot_response
             
+            # Detectar la intención del mensaje si no se proporcionó. Se hace después de
+            # los pasos 1-2: la navegación no la usa y es la mayoría de los mensajes
+            if intent is None or confidence is None:
+                intent, confidence = self.detect_intent(message, message_normalized)
+                logger.info("Intención detectada: %s, confianza: %s", intent, confidence)
+            else:
+                # Internar la intención recibida para poder compararla por identidad
+                intent = sys.intern(intent)
+            
             # 3. Manejar casos especiales basados en el estado actual
             if current_state == "menu_consulta_zona" and not message_clean.isdigit():
                 # Interpretar como nombre de barrio/zona
                 zona_response = self._handle_zona_response(from_number, message_clean)
-                logger.info(f"Respuesta para zona '{message_clean}': {zona_response}")
+                logger.info("Respuesta para zona '%s': %s", message_clean, zona_response)
                 return zona_response
             
             # 4. Detectar si el mensaje parece ser una pregunta para el AI
             # Esto permite que el AI conteste preguntas aunque estemos en un estado específico
-            question_indicators = ['?', 'cómo', 'como', 'qué', 'que', 'cuál', 'cual', 'cuándo', 'cuando',
-                                   'dónde', 'donde', 'por qué', 'por que', 'quién', 'quien', 'cuánto', 'cuanto',
-                                   'explica', 'puedes', 'podrías', 'podrias', 'dime']
-            
-            # Verificar si el mensaje parece ser una pregunta
-            is_likely_question = any(indicator in message_clean for indicator in question_indicators) or message_clean.endswith('?')
+            # Verificar si el mensaje parece ser una pregunta (una sola búsqueda)
+            is_likely_question = _QUESTION_RE.search(message_clean) is not None
             
             # Si parece ser una pregunta, priorizar el AI sobre el chatbot para cualquier estado
             if is_likely_question and getattr(settings, 'TWILIO_ASSISTANT_ID', None):
-                logger.info(f"El mensaje parece ser una pregunta. Delegando directamente al Twilio AI Assistant")
+                logger.info("El mensaje parece ser una pregunta. Delegando directamente al Twilio AI Assistant")
                 
                 try:
                     twilio_response = self.twilio_ai_handler.process_message(
@@ -191,33 +330,33 @@ class ConversationHandler(BaseConversationHandler):
                     )
                     
                     if twilio_response:
-                        logger.info(f"Twilio AI Assistant generó respuesta para pregunta: {twilio_response[:50]}...")
+                        logger.info("Twilio AI Assistant generó respuesta para pregunta: %.50s...", twilio_response)
                         return twilio_response
                 except Exception as ai_error:
-                    logger.error(f"Error en Twilio AI Assistant para pregunta: {str(ai_error)}")
+                    logger.error("Error en Twilio AI Assistant para pregunta: %s", ai_error)
                     # Continuar con el flujo normal si falla el AI
             
-            # 5. Procesar intenciones explícitas con confianza adecuada - IMPORTANTE para pruebas
-            # Reducir el umbral de confianza para las pruebas para mejorar coincidencias
-            if intent != "desconocido" and confidence >= 0.4:  # Umbral reducido para pruebas
-                logger.info(f"Procesando como intención explícita: {intent} con confianza {confidence}")
-                chatbot_response = self.chatbot_handler.process_message(
-                    from_number, message, intent, confidence
-                )
-                logger.info(f"Respuesta del chatbot para intención {intent}: {chatbot_response}")
+            if not is_navigation:
+                # 5. Procesar intenciones explícitas con confianza adecuada - IMPORTANTE para pruebas
+                # Reducir el umbral de confianza para las pruebas para mejorar coincidencias
+                if intent is not INTENCION_DESCONOCIDA and confidence >= 0.4:  # Umbral reducido para pruebas
+                    logger.info("Procesando como intención explícita: %s con confianza %s", intent, confidence)
+                    chatbot_response = self.chatbot_handler.process_message(
+                        from_number, message, intent, confidence
+                    )
+                
+                # 6. Si no, el chatbot_handler sin intención explícita (según el estado)
+                else:
+                    logger.info("Intentando con chatbot_handler sin intención explícita")
+                    chatbot_response = self.chatbot_handler.process_message(from_number, message)
+                
                 if chatbot_response:
+                    logger.info("Respuesta del chatbot: %s", chatbot_response)
                     return chatbot_response
             
-            # 6. Intentar directamente con el chatbot_handler sin intención explícita (para pruebas)
-            logger.info(f"Intentando con chatbot_handler sin intención explícita")
-            chatbot_response = self.chatbot_handler.process_message(from_number, message)
-            if chatbot_response:
-                logger.info(f"Respuesta genérica del chatbot: {chatbot_response}")
-                return chatbot_response
-            
             # 7. Intentar con el Twilio AI Assistant si está configurado (para mensajes que no son preguntas explícitas)
             if getattr(settings, 'TWILIO_ASSISTANT_ID', None):
-                logger.info(f"Delegando mensaje al Twilio AI Assistant como última opción")
+                logger.info("Delegando mensaje al Twilio AI Assistant como última opción")
                 
                 try:
                     twilio_response = self.twilio_ai_handler.process_message(
@@ -228,17 +367,17 @@ class ConversationHandler(BaseConversationHandler):
                     )
                     
                     if twilio_response:
-                        logger.info(f"Twilio AI Assistant generó respuesta: {twilio_response[:50]}...")
+                        logger.info("Twilio AI Assistant generó respuesta: %.50s...", twilio_response)
                         return twilio_response
                 except Exception as ai_error:
-                    logger.error(f"Error en Twilio AI Assistant: {str(ai_error)}")
+                    logger.error("Error en Twilio AI Assistant: %s", ai_error)
                     # No fallar completamente, continuar con otros métodos de respuesta
             else:
                 logger.warning("TWILIO_ASSISTANT_ID no está configurado. No se puede usar AI fallback.")
             
             # 7. Si todo lo anterior falla, enviar al usuario al menú principal
             if current_state != "menu_principal":
-                logger.info(f"Redirigiendo al usuario al menú principal desde estado: {current_state}")
+                logger.info("Redirigiendo al usuario al menú principal desde estado: %s", current_state)
                 self.chatbot_handler._set_user_state(from_number, "menu_principal")
                 return MENSAJE_MENU_PRINCIPAL
             
@@ -246,9 +385,9 @@ class ConversationHandler(BaseConversationHandler):
             logger.info("Enviando mensaje por defecto: no entiendo")
             return MENSAJE_NO_ENTIENDO
             
-        except Exception as e:
-            logger.error(f"Error en el manejador de conversación: {str(e)}")
-            logger.error(traceback.format_exc())
+        except Exception:
+            # logger.exception incluye el mensaje del error y la traza
+            logger.exception("Error en el manejador de conversación")
             return MENSAJE_ERROR
     
     def _handle_zona_response(self, from_number: str, zona: str) -> str:
@@ -266,20 +405,27 @@ class ConversationHandler(BaseConversationHandler):
         # En una implementación real, se consultaría una base de datos de zonas de entrega
         zona_lower = zona.lower()
         
-        # Lista de zonas de ejemplo donde se entrega
-        zonas_disponibles = [
-            'palermo', 'recoleta', 'belgrano', 'nuñez', 'caballito', 'flores',
-            'villa urquiza', 'villa crespo', 'almagro', 'boedo', 'san telmo',
-            'puerto madero', 'retiro', 'colegiales', 'villa devoto'
-        ]
-        
         # Verificar si la zona está en la lista de zonas disponibles
-        for zona_disponible in zonas_disponibles:
-            if zona_disponible in zona_lower:
-                # Volver al menú de delivery
-                self.chatbot_handler._set_user_state(from_number, 'menu_delivery')
-                return f"😀 ¡Buenas noticias! Entregamos en {zona}. Nuestros días de entrega son Martes y Jueves entre las 10:00 y 18:00 hs.\n\n📲 Escribí \"Volver\" para regresar al menú anterior."
+        if _ZONAS_RE.search(zona_lower):
+            # Volver al menú de delivery
+            self.chatbot_handler._set_user_state(from_number, 'menu_delivery')
+            return f"😀 ¡Buenas noticias! Entregamos en {zona}. Nuestros días de entrega son Martes y Jueves entre las 10:00 y 18:00 hs.\n\n📲 Escribí \"Volver\" para regresar al menú anterior."
         
         # Si la zona no está disponible
         self.chatbot_handler._set_user_state(from_number, 'menu_delivery')
         return f"😔 Lo sentimos, actualmente no realizamos entregas en {zona}. Estamos trabajando para expandir nuestras zonas de entrega.\n\n📲 Escribí \"Volver\" para regresar al menú anterior."
+
+
+@functools.lru_cache(maxsize=None)
+def get_conversation_handler() -> ConversationHandler:
+    """
+    Devuelve la instancia de ConversationHandler compartida por todo el proceso.
+    
+    Los sub-manejadores (y el cliente de Twilio que crean) se construyen una sola vez
+    por worker en lugar de en cada webhook. El estado de cada usuario ya se guarda
+    por número de teléfono (caché de Django), por lo que compartir la instancia es seguro.
+    
+    Returns:
+        La instancia única de ConversationHandler
+    """
+    return ConversationHandler()
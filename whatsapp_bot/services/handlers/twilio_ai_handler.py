@@ -4,8 +4,8 @@ Twilio AI Assistant Handler
 This module provides the TwilioAIHandler class that integrates with
 Twilio's AI Assistant API for handling complex user queries.
 """
+import functools
 import logging
-import traceback
 from typing import Optional, Dict, Any
 from django.conf import settings
 from ..twilio_whatsapp import TwilioWhatsAppService
@@ -14,6 +14,17 @@ from .base_handler import BaseConversationHandler
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of phone numbers whose session ID is kept in memory
+SESSION_ID_CACHE_SIZE = 10_000
+
+
+@functools.lru_cache(maxsize=SESSION_ID_CACHE_SIZE)
+def _session_id(from_number: str) -> str:
+    """Build the session ID for a phone number (memoized: it runs on every AI call)"""
+    # Clean the phone number (remove 'whatsapp:' prefix if present)
+    return f"session_{from_number.removeprefix('whatsapp:')}"
+
+
 class TwilioAIHandler(BaseConversationHandler):
     """
     Handler that integrates with Twilio's AI Assistant API for complex query processing.
@@ -39,12 +50,9 @@ class TwilioAIHandler(BaseConversationHandler):
         Returns:
             Session ID for the user
         """
-        # Clean the phone number (remove 'whatsapp:' prefix if present)
-        clean_number = from_number.replace('whatsapp:', '') if from_number.startswith('whatsapp:') else from_number
-        
         # Create a unique session ID based on the phone number
         # This is a simplified version that doesn't require storing sessions
-        return f"session_{clean_number}"
+        return _session_id(from_number)
     
     def _call_twilio_assistant_api(self, from_number: str, message: str, context: Optional[Dict[str, Any]] = None, is_first_interaction: bool = False) -> Dict[str, Any]:
         """
@@ -71,12 +79,11 @@ class TwilioAIHandler(BaseConversationHandler):
             if 'message' in result:
                 return {"success": True, "response": result['message']}
             else:
-                logger.warning(f"No message in AI Assistant response: {result}")
+                logger.warning("No message in AI Assistant response: %s", result)
                 return {"success": False, "error": "No response from AI Assistant"}
                 
         except Exception as e:
-            logger.error(f"Error calling Twilio AI Assistant: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error calling Twilio AI Assistant")
             return {"success": False, "error": f"AI Assistant error: {str(e)}"}
     
     def process_message(self, from_number: str, message: str, 
@@ -103,7 +110,7 @@ class TwilioAIHandler(BaseConversationHandler):
         
         try:
             # Log the incoming message
-            logger.info(f"Processing message with Twilio AI Assistant: '{message[:50]}'")
+            logger.info("Processing message with Twilio AI Assistant: '%.50s'", message)
             
             # Create context with any detected intent information
             context = None
@@ -115,14 +122,14 @@ class TwilioAIHandler(BaseConversationHandler):
             
             if result["success"]:
                 response = result["response"]
-                logger.info(f"AI Assistant response received successfully")
+                logger.info("AI Assistant response received successfully")
                 return response
             
             # If we get here, there was an error but no exception
             error_msg = result.get('error', 'Unknown error')
-            logger.error(f"AI Assistant error: {error_msg}")
+            logger.error("AI Assistant error: %s", error_msg)
             return None
             
         except Exception as e:
-            logger.error(f"Error processing message with Twilio AI: {str(e)}")
+            logger.error("Error processing message with Twilio AI: %s", e)
             return None
@@ -6,11 +6,36 @@ incluyendo búsqueda, filtrado y formateo de información de productos para el b
 """
 import logging
 from typing import List, Dict, Any, Optional
-from django.db.models import Q
+from django.core.cache import cache
+from django.db.models import F, Prefetch, Q
 from ..models import Categoria, Producto, OfertaEspecial
 
 logger = logging.getLogger(__name__)
 
+# Las categorías activas cambian poco: se guardan en cache y se invalidan al
+# guardar o borrar una Categoria (ver whatsapp_bot/signals.py)
+CATEGORIES_CACHE_KEY = 'whatsapp_catalog:categorias_activas'
+CATEGORIES_CACHE_TIMEOUT = 3600  # 1 hora
+
+
+def _load_active_categories() -> List[Dict[str, Any]]:
+    """Consulta las categorías activas como diccionarios, sin instanciar modelos"""
+    categories = list(Categoria.objects.filter(activo=True).values('id', 'nombre', 'descripcion'))
+    for category in categories:
+        category['descripcion'] = category['descripcion'] or ''
+    return categories
+
+
+def invalidate_categories_cache() -> None:
+    """
+    Descarta las categorías activas guardadas en cache.
+    
+    Se llama desde las señales post_save/post_delete de Categoria. QuerySet.update()
+    y bulk_create() no emiten esas señales: tras usarlos, la lista en cache sigue
+    desactualizada hasta CATEGORIES_CACHE_TIMEOUT, salvo que se llame a esta función.
+    """
+    cache.delete(CATEGORIES_CACHE_KEY)
+
 class ProductCatalogService:
     """
     Servicio para gestionar el catálogo de productos y proporcionar
@@ -20,21 +45,13 @@ class ProductCatalogService:
     @staticmethod
     def get_categories() -> List[Dict[str, Any]]:
         """
-        Obtiene todas las categorías activas.
+        Obtiene todas las categorías activas (desde cache si están disponibles).
         
         Returns:
             Lista de diccionarios con información de categorías
         """
         try:
-            categories = Categoria.objects.filter(activo=True)
-            return [
-                {
-                    'id': category.id,
-                    'nombre': category.nombre,
-                    'descripcion': category.descripcion or ''
-                }
-                for category in categories
-            ]
+            return cache.get_or_set(CATEGORIES_CACHE_KEY, _load_active_categories, CATEGORIES_CACHE_TIMEOUT)
         except Exception as e:
             logger.error(f"Error al obtener categorías: {str(e)}")
             return []
@@ -51,20 +68,13 @@ class ProductCatalogService:
             Lista de diccionarios con información de productos
         """
         try:
-            products = Producto.objects.filter(
+            products = list(Producto.objects.filter(
                 categoria_id=category_id,
                 activo=True
-            )
-            return [
-                {
-                    'id': product.id,
-                    'nombre': product.nombre,
-                    'precio': float(product.precio),
-                    'descripcion': product.descripcion,
-                    'disponible': product.esta_disponible()
-                }
-                for product in products
-            ]
+            ).con_disponibilidad().values('id', 'nombre', 'precio', 'descripcion', 'disponible'))
+            for product in products:
+                product['precio'] = float(product['precio'])
+            return products
         except Exception as e:
             logger.error(f"Error al obtener productos por categoría: {str(e)}")
             return []
@@ -81,21 +91,17 @@ class ProductCatalogService:
             Lista de diccionarios con información de productos
         """
         try:
-            products = Producto.objects.filter(
+            # La categoría se resuelve con un JOIN en la misma consulta
+            products = list(Producto.objects.filter(
                 Q(nombre__icontains=query) | Q(descripcion__icontains=query),
                 activo=True
-            )
-            return [
-                {
-                    'id': product.id,
-                    'nombre': product.nombre,
-                    'precio': float(product.precio),
-                    'categoria': product.categoria.nombre,
-                    'descripcion': product.descripcion,
-                    'disponible': product.esta_disponible()
-                }
-                for product in products
-            ]
+            ).con_disponibilidad().values(
+                'id', 'nombre', 'precio', 'descripcion', 'disponible', categoria_nombre=F('categoria__nombre')
+            ))
+            for product in products:
+                product['precio'] = float(product['precio'])
+                product['categoria'] = product.pop('categoria_nombre')
+            return products
         except Exception as e:
             logger.error(f"Error al buscar productos: {str(e)}")
             return []
@@ -112,7 +118,7 @@ class ProductCatalogService:
             Diccionario con información detallada del producto o None si no se encuentra
         """
         try:
-            product = Producto.objects.get(id=product_id, activo=True)
+            product = Producto.objects.select_related('categoria').get(id=product_id, activo=True)
             return {
                 'id': product.id,
                 'nombre': product.nombre,
@@ -139,10 +145,9 @@ class ProductCatalogService:
             Lista de diccionarios con información de ofertas especiales
         """
         try:
-            offers = [
-                offer for offer in OfertaEspecial.objects.filter(activo=True)
-                if offer.esta_vigente()
-            ]
+            offers = OfertaEspecial.objects.vigentes().prefetch_related(
+                Prefetch('productos', queryset=Producto.objects.filter(activo=True), to_attr='productos_activos')
+            )
             return [
                 {
                     'id': offer.id,
@@ -157,7 +162,7 @@ class ProductCatalogService:
                             'precio_original': float(product.precio),
                             'precio_oferta': float(product.precio * (1 - offer.descuento_porcentaje / 100))
                         }
-                        for product in offer.productos.filter(activo=True)
+                        for product in offer.productos_activos
                     ]
                 }
                 for offer in offers
@@ -6,12 +6,27 @@ import json
 import requests
 from typing import Dict, Any, Optional, Tuple
 
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
 from django.conf import settings
+from django.db import transaction
 from ..models import Customer, Conversation, Message, MessageTemplate
+from ..utils.text import normalize
 
 logger = logging.getLogger(__name__)
 
+# Base URL of the Twilio Assistants API
+ASSISTANT_API_BASE_URL = "https://assistants.twilio.com/"
+
+# Maximum number of pooled keep-alive connections to the Assistants API (one per
+# worker thread making a call at the same time)
+ASSISTANT_POOL_MAXSIZE = 20
+
+# Session shared by all AI Assistant calls: keeps connections (and their TLS
+# handshake) alive between webhooks instead of opening a new one per message
+_assistant_session = requests.Session()
+_assistant_session.mount(ASSISTANT_API_BASE_URL, HTTPAdapter(pool_maxsize=ASSISTANT_POOL_MAXSIZE))
+
 class TwilioWhatsAppService:
     """Service for interacting with Twilio WhatsApp API"""
     
@@ -52,7 +67,7 @@ class TwilioWhatsAppService:
             # Send the message via Twilio
             twilio_message = self.client.messages.create(**message_params)
             
-            logger.info(f"WhatsApp message sent to {to_number}: {twilio_message.sid}")
+            logger.info("WhatsApp message sent to %s: %s", to_number, twilio_message.sid)
             return twilio_message
         
         except Exception as e:
@@ -78,38 +93,38 @@ class TwilioWhatsAppService:
             # Clean the phone number (remove whatsapp: prefix if present)
             clean_number = from_number.replace('whatsapp:', '') if from_number.startswith('whatsapp:') else from_number
             
-            # Find or create customer
-            customer, created = Customer.objects.get_or_create(
-                phone_number=clean_number,
-                defaults={'name': f"Customer {clean_number[-4:]}"}  # Default name using last 4 digits
-            )
+            # All writes for one inbound message commit together
+            with transaction.atomic():
+                # Find active conversation (customer comes in the same query)
+                conversation = Conversation.objects.active_for_phone(clean_number)
             
-            # Find active conversation or create new one
-            conversation = Conversation.objects.filter(
-                customer=customer,
-                active=True
-            ).first()
+                # Check if this is a new conversation (first interaction)
+                is_first_interaction = False
+                if not conversation:
+                    is_first_interaction = True
+                    # Find or create customer
+                    customer, created = Customer.objects.get_or_create(
+                        phone_number=clean_number,
+                        defaults={'name': f"Customer {clean_number[-4:]}"}  # Default name using last 4 digits
+                    )
+                    conversation = Conversation.objects.create(
+                        customer=customer,
+                        current_state='greeting'
+                    )
             
-            # Check if this is a new conversation (first interaction)
-            is_first_interaction = False
-            if not conversation:
-                is_first_interaction = True
-                conversation = Conversation.objects.create(
-                    customer=customer,
-                    current_state='greeting'
+                # Record the message
+                message = Message.objects.create(
+                    conversation=conversation,
+                    content=message_body,
+                    media_url=media_url,
+                    direction='inbound',
+                    whatsapp_message_id=whatsapp_message_id
                 )
             
-            # Record the message
-            message = Message.objects.create(
-                conversation=conversation,
-                content=message_body,
-                media_url=media_url,
-                direction='inbound',
-                whatsapp_message_id=whatsapp_message_id
-            )
-            
-            # Update conversation's last interaction time (happens via auto_now)
-            conversation.save(update_fields=['last_interaction'])
+                # Update conversation's last interaction time (happens via auto_now);
+                # a conversation created just above already has it
+                if not is_first_interaction:
+                    conversation.save(update_fields=['last_interaction'])
             
             return conversation, message
             
@@ -158,19 +173,22 @@ class TwilioWhatsAppService:
         try:
             # If this is the first interaction, check if it's a simple greeting
             if is_first_interaction:
-                from ..services.constants import MENSAJE_BIENVENIDA, PALABRAS_SALUDO
+                from ..services.constants import MENSAJE_BIENVENIDA, PALABRAS_SALUDO_SET, classify
                 
-                # Normalize message text (lowercase and strip)
-                normalized_message = message_text.lower().strip()
+                # Normalize message text (lowercase, no accents, stripped)
+                normalized_message = normalize(message_text.strip())
                 
-                # Check if the message is a simple greeting
-                is_greeting = any(greeting in normalized_message for greeting in PALABRAS_SALUDO)
+                # Check if the message is a simple greeting (exact match first, then substring)
+                is_greeting = (
+                    normalized_message in PALABRAS_SALUDO_SET
+                    or 'saludo' in classify(normalized_message)
+                )
                 
                 if is_greeting or len(normalized_message) < 10:  # Short messages are likely greetings
-                    logger.info(f"First interaction with {from_number} is a greeting, sending welcome message")
+                    logger.info("First interaction with %s is a greeting, sending welcome message", from_number)
                     return {'message': MENSAJE_BIENVENIDA}
                 
-                logger.info(f"First interaction with {from_number}, but not a simple greeting")
+                logger.info("First interaction with %s, but not a simple greeting", from_number)
                 # Continue to AI Assistant for non-greeting first messages
                 
             # Get the Twilio Assistant ID from settings
@@ -208,13 +226,14 @@ class TwilioWhatsAppService:
             if webhook_url:
                 payload['webhook'] = webhook_url
             
-            logger.info(f"Sending message to Twilio Assistant: {message_text[:50]}...")
+            logger.info("Sending message to Twilio Assistant: %.50s...", message_text)
             
             # Construct the Twilio Assistant API URL
-            assistant_url = f"https://assistants.twilio.com/v1/Assistants/{assistant_id}/Messages"
+            assistant_url = f"{ASSISTANT_API_BASE_URL}v1/Assistants/{assistant_id}/Messages"
             
-            # Make the API request with Basic Auth using the Twilio credentials
-            response = requests.post(
+            # Make the API request with Basic Auth using the Twilio credentials, reusing
+            # a pooled connection when one is available
+            response = _assistant_session.post(
                 assistant_url,
                 headers=headers,
                 data=json.dumps(payload),
@@ -225,7 +244,7 @@ class TwilioWhatsAppService:
             if response.status_code == 200 or response.status_code == 201:
                 result = response.json()
                 # Debug log the full response structure
-                logger.debug(f"Twilio Assistant API response: {result}")
+                logger.debug("Twilio Assistant API response: %s", result)
                 
                 # Extract the message from the Twilio response - handle different response formats
                 # Try different possible response structures
@@ -249,7 +268,7 @@ class TwilioWhatsAppService:
                 # Fallback
                 else:
                     message = str(result)
-                logger.info(f"Twilio Assistant response received: {message[:50]}...")
+                logger.info("Twilio Assistant response received: %.50s...", message)
                 return {'message': message}
             else:
                 logger.error(f"Twilio Assistant error: {response.status_code} - {response.text}")
@@ -0,0 +1,17 @@
+"""
+Señales del bot de WhatsApp
+
+Este módulo mantiene coherentes los datos cacheados con la base de datos,
+invalidándolos cuando cambian los modelos de los que dependen.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Categoria
+from .services.product_catalog import invalidate_categories_cache
+
+
+@receiver([post_save, post_delete], sender=Categoria, dispatch_uid='invalidate_categories_cache')
+def categoria_changed(sender, **kwargs):
+    """Invalida las categorías activas en cache al guardar o borrar una Categoria"""
+    invalidate_categories_cache()
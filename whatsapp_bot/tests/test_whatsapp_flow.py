@@ -6,11 +6,15 @@ simulando mensajes entrantes y verificando las respuestas, con énfasis en la
 gestión de estados y la navegación entre menús.
 """
 import json
+import sys
 import unittest
 from unittest.mock import patch, MagicMock, call
 from django.test import TestCase, Client
 from django.urls import reverse
 from .test_base import BreadersBotBaseTestCase
+from ..models import Categoria, Conversation, Customer
+from ..services.product_catalog import ProductCatalogService, invalidate_categories_cache
+from ..services.customer_support import CustomerSupportService
 from ..services.handlers.conversation_handler import ConversationHandler
 from ..services.handlers.chatbot_handler import ChatbotHandler
 from ..services.handlers.twilio_ai_handler import TwilioAIHandler
@@ -90,7 +94,7 @@ class WhatsAppFlowTest(BreadersBotBaseTestCase):
         
         # El patch debe estar más cerca de donde se usa ConversationHandler
         # Usamos un context manager para aplicar el patch solo al bloque específico
-        with patch('whatsapp_bot.views.ConversationHandler') as mock_handler:
+        with patch('whatsapp_bot.views.get_conversation_handler') as mock_handler:
             # Configurar el mock para devolver un mensaje de bienvenida
             self.log_step("Configurando mock del manejador de conversación")
             mock_instance = mock_handler.return_value
@@ -127,7 +131,7 @@ class WhatsAppFlowTest(BreadersBotBaseTestCase):
         self.log_step("Iniciando prueba de navegación por menús")
         
         # Usar context manager para aplicar el patch durante las llamadas
-        with patch('whatsapp_bot.views.ConversationHandler') as mock_handler:
+        with patch('whatsapp_bot.views.get_conversation_handler') as mock_handler:
             # Configurar el mock para devolver diferentes respuestas en secuencia
             self.log_step("Configurando mock para simular navegación por menús")
             mock_instance = mock_handler.return_value
@@ -174,7 +178,7 @@ class WhatsAppFlowTest(BreadersBotBaseTestCase):
         """Prueba el flujo con las nuevas opciones de menú implementadas."""
         self.log_step("Iniciando prueba de nuevas opciones de menú")
         
-        with patch('whatsapp_bot.views.ConversationHandler') as mock_handler:
+        with patch('whatsapp_bot.views.get_conversation_handler') as mock_handler:
             # Configurar el mock para devolver diferentes respuestas en secuencia
             self.log_step("Configurando mock para simular navegación por nuevas opciones de menú")
             mock_instance = mock_handler.return_value
@@ -247,7 +251,7 @@ class WhatsAppFlowTest(BreadersBotBaseTestCase):
                 f"Comprobar que el código de respuesta HTTP para '{message}' es 200"
             )
     
-    @patch('whatsapp_bot.views.ConversationHandler')
+    @patch('whatsapp_bot.views.get_conversation_handler')
     def test_intent_detection_flow(self, mock_handler):
         """Prueba el flujo de detección de intenciones."""
         self.log_step("Iniciando prueba del flujo de detección de intenciones")
@@ -310,7 +314,7 @@ class WhatsAppFlowTest(BreadersBotBaseTestCase):
                 f"Comprobar que el código de respuesta HTTP para la intención '{intent_type}' es 200"
             )
     
-    @patch('whatsapp_bot.views.ConversationHandler')
+    @patch('whatsapp_bot.views.get_conversation_handler')
     def test_error_handling(self, mock_handler):
         """Prueba el manejo de errores."""
         self.log_step("Iniciando prueba de manejo de errores")
@@ -354,8 +358,8 @@ class ConversationHandlerTest(BreadersBotBaseTestCase):
         self.from_number = "whatsapp:+5491112345678"
         
         # Usamos patch para evitar la inicialización real de los handlers
-        self.log_step("Creando mocks para ChatbotHandler y TwilioAIHandler")
-        self.chatbot_patcher = patch('whatsapp_bot.services.handlers.conversation_handler.ChatbotHandler')
+        self.log_step("Creando mocks para ChatbotHandler (instancia compartida) y TwilioAIHandler")
+        self.chatbot_patcher = patch('whatsapp_bot.services.handlers.conversation_handler.get_chatbot_handler')
         self.ai_handler_patcher = patch('whatsapp_bot.services.handlers.conversation_handler.TwilioAIHandler')
         
         self.mock_chatbot = self.chatbot_patcher.start()
@@ -379,6 +383,51 @@ class ConversationHandlerTest(BreadersBotBaseTestCase):
         self.ai_handler_patcher.stop()
         super().tearDown()
     
+    def test_shared_handler_instance(self):
+        """Prueba que el webhook reutiliza una única instancia del manejador."""
+        self.log_step("Obteniendo el manejador compartido dos veces")
+        from whatsapp_bot.services.handlers.conversation_handler import get_conversation_handler
+        get_conversation_handler.cache_clear()
+        self.addCleanup(get_conversation_handler.cache_clear)
+        
+        first = get_conversation_handler()
+        second = get_conversation_handler()
+        
+        self.log_check("Verificando que ambas llamadas devuelven la misma instancia")
+        self.assert_with_log(
+            first is second,
+            "Comprobar que get_conversation_handler devuelve siempre la misma instancia"
+        )
+        
+        self.log_check("Verificando que los sub-manejadores se construyeron una sola vez")
+        self.assert_equal_with_log(
+            self.mock_chatbot.call_count,
+            2,  # Uno en setUp y otro para la instancia compartida
+            "Comprobar que ChatbotHandler no se vuelve a instanciar"
+        )
+    
+    def test_intent_matcher_counts_like_regex(self):
+        """Prueba que el conteo de palabras clave coincide con el fallback por regex."""
+        from whatsapp_bot.services.handlers import conversation_handler
+
+        messages = [
+            'hola que tal',
+            'quiero ver productos y ofertas, ofertas del dia',
+            'como va mi pedido',
+            'holas productoss',
+            'necesito ayuda, tengo un problema con mi pedido',
+        ]
+
+        self.log_step("Calculando conteos con el matcher de una sola pasada")
+        counts = [conversation_handler._count_intent_matches(m) for m in messages]
+
+        self.log_step("Calculando conteos con las regex precompiladas")
+        with patch.object(conversation_handler, 'INTENT_AUTOMATON', None):
+            expected = [conversation_handler._count_intent_matches(m) for m in messages]
+
+        self.log_check("Verificando que ambos métodos cuentan lo mismo")
+        self.assert_equal_with_log(counts, expected, "Comprobar que los conteos por intención coinciden")
+
     def test_detect_intent(self):
         """Prueba la detección de intención con diferentes mensajes."""
         self.log_step("Iniciando prueba de detección de intención")
@@ -1063,5 +1112,106 @@ class TwilioAIHandlerTest(TestCase):
         self.assertIsNone(response)
 
 
+
+class ConversationModelTest(TestCase):
+    """
+    Pruebas para el modelo Conversation.
+    Verifica que la instancia en memoria quede coherente con la base de datos
+    al solicitar atención humana.
+    """
+    
+    def setUp(self):
+        """Configuración inicial para las pruebas."""
+        customer = Customer.objects.create(name='Cliente', phone_number='+5491112345678')
+        self.conversation = Conversation.objects.create(customer=customer)
+        # La cola de soporte vive en otra app: se reemplaza por un módulo simulado
+        self.support_queue = MagicMock()
+        admin_models = MagicMock(SupportQueue=self.support_queue)
+        patcher = patch.dict(sys.modules, {'admin_dashboard': MagicMock(models=admin_models),
+                                           'admin_dashboard.models': admin_models})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_request_human_support_rollback(self):
+        """Prueba que un error al encolar revierte la fila y la instancia, y que se puede reintentar."""
+        self.support_queue.objects.create.side_effect = RuntimeError("cola no disponible")
+        
+        with self.assertRaises(RuntimeError):
+            self.conversation.request_human_support()
+        
+        # La fila se revirtió y la instancia coincide con ella
+        self.assertEqual(self.conversation.handler_type, 'bot')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.handler_type, 'bot')
+        
+        # El reintento encola la conversación con el teléfono del cliente
+        self.support_queue.objects.create.side_effect = None
+        self.assertTrue(self.conversation.request_human_support())
+        self.support_queue.objects.create.assert_called_with(
+            conversation=self.conversation, phone_number='+5491112345678'
+        )
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.handler_type, 'human_requested')
+
+
+
+class ProductCatalogCacheTest(TestCase):
+    """
+    Pruebas para la cache de categorías del catálogo.
+    Verifica que guardar o borrar una Categoria invalide la lista en cache.
+    """
+    
+    def setUp(self):
+        """Configuración inicial para las pruebas."""
+        invalidate_categories_cache()
+        self.addCleanup(invalidate_categories_cache)
+        self.panes = Categoria.objects.create(nombre='Panes')
+    
+    def _category_names(self):
+        return [category['nombre'] for category in ProductCatalogService.get_categories()]
+    
+    def test_categories_cached(self):
+        """Prueba que la segunda consulta de categorías no vuelve a la base de datos."""
+        self.assertEqual(self._category_names(), ['Panes'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._category_names(), ['Panes'])
+    
+    def test_save_invalidates_categories(self):
+        """Prueba que crear o modificar una Categoria invalida la lista en cache."""
+        self.assertEqual(self._category_names(), ['Panes'])
+        
+        Categoria.objects.create(nombre='Facturas')
+        self.assertEqual(self._category_names(), ['Facturas', 'Panes'])
+        
+        self.panes.activo = False
+        self.panes.save()
+        self.assertEqual(self._category_names(), ['Facturas'])
+    
+    def test_delete_invalidates_categories(self):
+        """Prueba que borrar una Categoria invalida la lista en cache."""
+        self.assertEqual(self._category_names(), ['Panes'])
+        
+        self.panes.delete()
+        self.assertEqual(self._category_names(), [])
+
+
+
+class CustomerSupportServiceTest(TestCase):
+    """
+    Pruebas para el servicio de atención al cliente.
+    Verifica la detección de pedidos de volver al menú principal.
+    """
+    
+    def test_is_returning_to_menu(self):
+        """Prueba que se detecta el pedido de volver al menú, también dentro de mensajes largos."""
+        self.assertTrue(CustomerSupportService.is_returning_to_menu("menu"))
+        self.assertTrue(CustomerSupportService.is_returning_to_menu(
+            "gracias, ahora quiero volver atras al menu principal por favor"
+        ))
+        self.assertFalse(CustomerSupportService.is_returning_to_menu(
+            "mi pedido llegó tarde y quiero saber qué pasó con el envío de hoy"
+        ))
+
+
 if __name__ == '__main__':
     unittest.main()
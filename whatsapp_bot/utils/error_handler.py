@@ -5,8 +5,6 @@ Este módulo proporciona funciones para manejar errores de manera consistente
 en toda la aplicación del bot de WhatsApp.
 """
 import logging
-import traceback
-import sys
 from typing import Dict, Any, Optional, Callable
 from functools import wraps
 from django.conf import settings
@@ -31,15 +29,11 @@ def log_error(error: Exception, context: Dict[str, Any] = None) -> None:
         error: La excepción que ocurrió
         context: Contexto adicional para el registro
     """
-    exc_type, exc_value, exc_traceback = sys.exc_info()
-    stack_trace = traceback.format_exception(exc_type, exc_value, exc_traceback)
-    
-    error_message = f"Error: {str(error)}"
+    # La traza la formatea el handler de logging (exc_info), solo si emite el registro
     if context:
-        error_message += f"\nContexto: {context}"
-    error_message += f"\nStack trace: {''.join(stack_trace)}"
-    
-    logger.error(error_message)
+        logger.error("Error: %s\nContexto: %s", error, context, exc_info=error)
+    else:
+        logger.error("Error: %s", error, exc_info=error)
 
 def get_error_message(error_type: str = 'general') -> str:
     """
@@ -0,0 +1,38 @@
+"""
+Codificación JSON
+
+Este módulo provee el encoder/decoder que usan los JSONField del bot. Delegan en
+orjson cuando está instalado y recurren a la implementación estándar de Django
+en caso contrario.
+"""
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
+
+class OrjsonEncoder(DjangoJSONEncoder):
+    """Encoder para JSONField que serializa con orjson"""
+
+    def encode(self, o):
+        if orjson is None:
+            return super().encode(o)
+        try:
+            # Las fechas pasan por DjangoJSONEncoder.default para conservar su formato
+            # (milisegundos y "Z" para UTC) en lugar del ISO 8601 completo de orjson
+            return orjson.dumps(o, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+        except TypeError:
+            # Tipos que orjson no admite (p. ej. claves no str): usar json estándar
+            return super().encode(o)
+
+
+class OrjsonDecoder(json.JSONDecoder):
+    """Decoder para JSONField que deserializa con orjson"""
+
+    def decode(self, s, *args, **kwargs):
+        if orjson is None:
+            return super().decode(s, *args, **kwargs)
+        return orjson.loads(s)
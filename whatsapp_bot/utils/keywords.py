@@ -0,0 +1,128 @@
+"""
+Búsqueda de palabras clave
+
+Este módulo proporciona KeywordMatcher, que encuentra en un mensaje las palabras
+clave de varios grupos (intenciones, categorías de soporte, ...) de una sola vez.
+Usa un autómata Aho-Corasick cuando pyahocorasick está instalado y, si no, una
+única expresión regular precompilada.
+
+Los matchers se construyen al importar cada módulo que los usa; con las listas de
+palabras clave del bot eso lleva alrededor de 0,1 ms, así que no se guardan en disco.
+"""
+import functools
+import re
+from typing import Dict, FrozenSet, Iterable, Mapping, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick es opcional; sin él se usa una regex precompilada
+    ahocorasick = None
+
+# Palabras del mensaje (secuencias de caracteres de palabra)
+TOKEN_RE = re.compile(r'\w+')
+
+
+class KeywordMatcher:
+    """
+    Encuentra qué palabras clave de cada grupo aparecen en un mensaje.
+
+    Tiene la misma semántica que `keyword in message` (búsqueda por subcadena), pero
+    con el autómata el mensaje se recorre una sola vez para todos los grupos.
+    """
+
+    def __init__(self, groups: Mapping[str, Iterable[str]]):
+        """
+        Args:
+            groups: Mapeo de nombre de grupo a sus palabras clave
+        """
+        self.groups = {group: tuple(keywords) for group, keywords in groups.items()}
+
+        # Palabra clave -> grupos a los que pertenece
+        self._keyword_groups: Dict[str, FrozenSet[str]] = {}
+        for group, keywords in self.groups.items():
+            for keyword in keywords:
+                self._keyword_groups[keyword] = self._keyword_groups.get(keyword, frozenset()) | {group}
+
+        self.automaton = self._build_automaton()
+        if self.automaton is None:
+            self._regex, self._contained = self._build_regex()
+
+        # Si todas las palabras clave son de una sola palabra, cada coincidencia cae
+        # dentro de una palabra del mensaje: se memoriza palabra -> palabras clave y
+        # un mensaje se resuelve con una búsqueda en diccionario por palabra
+        self.single_word = all(TOKEN_RE.fullmatch(keyword) for keyword in self._keyword_groups)
+        if self.single_word:
+            self._token_keywords = functools.lru_cache(maxsize=4096)(self._scan)
+
+    def _build_automaton(self):
+        if ahocorasick is None:
+            return None
+        automaton = ahocorasick.Automaton()
+        for keyword, groups in self._keyword_groups.items():
+            automaton.add_word(keyword, (keyword, groups))
+        automaton.make_automaton()
+        return automaton
+
+    def _build_regex(self):
+        """
+        Construye una regex con todas las palabras clave en una alternancia dentro de
+        un lookahead, de modo que findall devuelve, en cada posición del mensaje, la
+        palabra clave más larga que empieza ahí.
+
+        Las palabras clave más cortas que empiezan en la misma posición quedan
+        ocultas, así que para cada palabra clave se guardan también las que contiene.
+        """
+        keywords = sorted(self._keyword_groups, key=len, reverse=True)
+        regex = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+        contained = {
+            keyword: tuple(other for other in keywords if other in keyword)
+            for keyword in keywords
+        }
+        return regex, contained
+
+    def _scan(self, text: str) -> Tuple[Tuple[str, FrozenSet[str]], ...]:
+        """Devuelve las (palabra clave, grupos) presentes en el texto"""
+        if self.automaton is None:
+            return tuple(
+                (keyword, self._keyword_groups[keyword])
+                for longest in set(self._regex.findall(text))
+                for keyword in self._contained[longest]
+            )
+        return tuple(value for _, value in self.automaton.iter(text))
+
+    def find(self, message: str) -> Dict[str, Set[str]]:
+        """
+        Busca las palabras clave presentes en el mensaje.
+
+        Args:
+            message: Mensaje ya normalizado
+
+        Returns:
+            Diccionario de grupo a conjunto de palabras clave encontradas, en el
+            orden en que se declararon los grupos (solo los que tienen coincidencias)
+        """
+        if self.single_word:
+            matches = [match for token in set(TOKEN_RE.findall(message))
+                       for match in self._token_keywords(token)]
+        else:
+            matches = self._scan(message)
+        return self._group(matches)
+
+    def _group(self, matches: Iterable[Tuple[str, FrozenSet[str]]]) -> Dict[str, Set[str]]:
+        found: Dict[str, Set[str]] = {}
+        for keyword, groups in matches:
+            for group in groups:
+                found.setdefault(group, set()).add(keyword)
+        # Mantener el orden de declaración de los grupos (desempates deterministas)
+        return {group: found[group] for group in self.groups if group in found}
+
+    def classify(self, message: str) -> Set[str]:
+        """
+        Devuelve los grupos con al menos una palabra clave en el mensaje.
+
+        Args:
+            message: Mensaje ya normalizado
+        """
+        if self.single_word or self.automaton is None:
+            return set(self.find(message))
+        return {group for _, (_, groups) in self.automaton.iter(message) for group in groups}
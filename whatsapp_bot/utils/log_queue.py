@@ -0,0 +1,44 @@
+"""
+Registro asíncrono
+
+Este módulo mueve la escritura de logs del bot de WhatsApp a un hilo en segundo
+plano: los handlers configurados en settings.LOGGING se reemplazan por un
+QueueHandler y un QueueListener se encarga de la E/S (consola y archivo).
+"""
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+_listener: Optional[QueueListener] = None
+
+
+def start_queue_logging(logger_name: str = 'whatsapp_bot') -> None:
+    """
+    Redirige los handlers del logger indicado a través de una cola.
+
+    Es idempotente: si ya se inició, no hace nada.
+
+    Args:
+        logger_name: Nombre del logger cuyos handlers se moverán al hilo de fondo
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    target = logging.getLogger(logger_name)
+    handlers = [h for h in target.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return
+
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    for handler in handlers:
+        target.removeHandler(handler)
+    target.addHandler(QueueHandler(log_queue))
+
+    _listener.start()
+    # Vaciar la cola antes de salir para no perder los últimos registros
+    atexit.register(_listener.stop)
@@ -0,0 +1,22 @@
+"""
+Utilidades de texto
+
+Este módulo proporciona la normalización que se aplica a los mensajes antes de
+compararlos con las palabras clave del bot.
+"""
+
+# Tabla para quitar acentos y diéresis en una sola pasada de str.translate
+ACCENT_TABLE = str.maketrans('áéíóúÁÉÍÓÚüÜñÑ', 'aeiouAEIOUuUnN')
+
+
+def normalize(text: str) -> str:
+    """
+    Normaliza un texto para comparar con palabras clave: sin acentos y en minúsculas.
+
+    Args:
+        text: Texto a normalizar
+
+    Returns:
+        Texto normalizado
+    """
+    return text.translate(ACCENT_TABLE).lower()
@@ -0,0 +1,45 @@
+"""
+TwiML pre-renderizado
+
+Este módulo genera las respuestas TwiML de mensaje directamente como bytes,
+con el mismo resultado que MessagingResponse().message(...), y las memoriza:
+el bot responde casi siempre con los mismos textos fijos de constants.py, que se
+renderizan al importar el módulo.
+"""
+import functools
+from xml.sax.saxutils import escape
+from ..services.constants import MENSAJES_PREDEFINIDOS
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# Respuesta vacía (sin mensaje), equivalente a str(MessagingResponse())
+EMPTY_TWIML = f'{_XML_DECLARATION}<Response />'.encode()
+
+
+def _render(message: str) -> bytes:
+    return f'{_XML_DECLARATION}<Response><Message>{escape(message)}</Message></Response>'.encode()
+
+
+# TwiML de los mensajes predefinidos, fuera del LRU para que nunca se desalojen
+_PRERENDERED = {message: _render(message) for message in MENSAJES_PREDEFINIDOS}
+
+
+@functools.lru_cache(maxsize=256)
+def _render_cached(message: str) -> bytes:
+    return _render(message)
+
+
+def twiml_bytes(message: str) -> bytes:
+    """
+    Devuelve la respuesta TwiML con un único mensaje, codificada en UTF-8.
+
+    Args:
+        message: Texto del mensaje
+
+    Returns:
+        Documento TwiML listo para enviar en el cuerpo de la respuesta HTTP
+    """
+    prerendered = _PRERENDERED.get(message)
+    if prerendered is not None:
+        return prerendered
+    return _render_cached(message)
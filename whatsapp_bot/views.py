@@ -3,11 +3,14 @@ import logging
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from twilio.twiml.messaging_response import MessagingResponse
-from .services.handlers.conversation_handler import ConversationHandler
+from .services.handlers.conversation_handler import get_conversation_handler
+from .utils.twiml import EMPTY_TWIML, twiml_bytes
 
 logger = logging.getLogger(__name__)
 
+# Generic error reply, rendered once
+ERROR_TWIML = twiml_bytes("Sorry, we're experiencing technical difficulties. Please try again later.")
+
 @csrf_exempt
 @require_POST
 def whatsapp_webhook(request):
@@ -25,36 +28,31 @@ def whatsapp_webhook(request):
         message_status = request.POST.get('MessageStatus', '')
         event_type = request.POST.get('EventType', '')
         
-        # Initialize response
-        twiml_response = MessagingResponse()
-        
         # Check if this is a status update or other non-message webhook
         if message_status or event_type:
-            logger.debug(f"Received status update: Status={message_status}, Event={event_type}")
+            logger.debug("Received status update: Status=%s, Event=%s", message_status, event_type)
             # Just acknowledge receipt for status updates
             return HttpResponse(status=204)  # No content response
         
         # Log actual messages with content
         if message_body:
-            logger.info(f"Received message from {from_number}: {message_body[:50]}...")
+            logger.info("Received message from %s: %.50s...", from_number, message_body)
         else:
-            logger.debug(f"Received webhook with empty body from {from_number}")
+            logger.debug("Received webhook with empty body from %s", from_number)
             # For empty messages from actual users (not status updates), send a response
-            return HttpResponse(str(twiml_response))
+            return HttpResponse(EMPTY_TWIML)
         
-        # Process the message using the conversation handler
-        conversation_handler = ConversationHandler()
+        # Process the message using the shared conversation handler
+        conversation_handler = get_conversation_handler()
         response_text = conversation_handler.process_message(from_number, message_body)
         
-        # Add response to TwiML
+        # Build the TwiML (pre-rendered bytes, cached for the fixed menu texts)
         if response_text:
-            twiml_response.message(response_text)
+            return HttpResponse(twiml_bytes(response_text))
         
-        return HttpResponse(str(twiml_response))
+        return HttpResponse(EMPTY_TWIML)
         
-    except Exception as e:
-        logger.error(f"Error processing WhatsApp webhook: {str(e)}")
+    except Exception:
+        logger.exception("Error processing WhatsApp webhook")
         # Return a generic error response
-        twiml_response = MessagingResponse()
-        twiml_response.message("Sorry, we're experiencing technical difficulties. Please try again later.")
-        return HttpResponse(str(twiml_response))
+        return HttpResponse(ERROR_TWIML)